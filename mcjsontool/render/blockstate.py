@@ -0,0 +1,303 @@
+import itertools
+import json
+import os
+import random
+
+from mcjsontool.render.model import BlockModel
+from ..resource.workspace import Workspace, DomainResourceLocation
+
+
+def _value_string(value):
+    """
+    Property values are strings, but some files write booleans and numbers as json ones
+    """
+    if isinstance(value, bool):
+        return "true" if value else "false"
+    return str(value)
+
+
+class Variant:
+    """
+    One model a blockstate can pick, and how it's rotated (in degrees, multiples of 90).
+
+    Use with :py:meth:`BlockModel.apply_state`.
+    """
+
+    __slots__ = ("model", "x", "y", "uvlock", "weight")
+
+    def __init__(self, model, x=0, y=0, uvlock=False, weight=1):
+        """
+        :param model: location of the model
+        :param x: rotation around x
+        :param y: rotation around y
+        :param uvlock: if textures shouldn't rotate with the model
+        :param weight: how likely this variant is to be picked out of a list of them
+        """
+        self.model = model
+        self.x = x
+        self.y = y
+        self.uvlock = uvlock
+        self.weight = weight
+
+    @classmethod
+    def from_json(cls, data):
+        """
+        Parse a variant
+
+        :param data: the variant's json object
+        """
+        namespace, path = data["model"].split(":", 1) if ":" in data["model"] else ("minecraft", data["model"])
+        if "/" not in path:
+            path = "block/" + path  # old (1.12) files give models relative to models/block
+        return cls(DomainResourceLocation("models", namespace, path, filetype=".json"), data.get("x", 0),
+                   data.get("y", 0), data.get("uvlock", False), data.get("weight", 1))
+
+    @property
+    def rotation(self):
+        return self.x, self.y, self.uvlock
+
+    def __repr__(self):
+        return f"Variant({self.model}, x={self.x}, y={self.y}, uvlock={self.uvlock})"
+
+
+class BlockState:
+    """
+    A compiled blockstate file (blockstates/*.json), which picks models for a block from its properties.
+
+    Both kinds of file are supported:
+        - variants: each key (like "facing=east,half=top") is a set of property values and gives one model
+        - multipart: every case whose "when" matches adds a model
+
+    Files are compiled once so resolving a state is cheap. Property values are interned to small ints (their index in
+    properties[name]). Variants are looked up in a dict keyed by the tuple of the ids of the properties their keys
+    use. Every property value also gets a bit, and each multipart "when" is compiled to a list of masks of the bits it
+    doesn't allow (one per OR'd clause), so a case applies if any mask has nothing in common with the state's bits.
+
+    Each property gets one extra bit for values the file never mentions (or that are missing from the state), so
+    negated conditions ("!value") still match them.
+    """
+
+    def __init__(self):
+        self.location = None
+        self.fingerprint = None
+        self.properties = {}  # name -> list of values mentioned in the file, a value's index is its id
+
+        self._value_ids = {}  # name -> {value: id}
+        self._bits = {}  # name -> first bit of the property's values, the unknown value bit is after them
+        self._variant_groups = []  # (property names, {tuple of ids: variants})
+        self._multipart = []  # (masks, variants)
+
+    @classmethod
+    def load_from_file(cls, workspace: Workspace, location):
+        """
+        Load and compile a blockstate
+
+        Compiled blockstates are cached on the workspace, so each file is only compiled once while it stays the same.
+
+        .. danger:
+            The returned blockstate is shared with the cache, don't modify it!
+
+        :param workspace: workspace to load in
+        :param location: location/path to the blockstate
+        :rtype: BlockState
+        """
+        realpath = os.path.normpath(location if not hasattr(location, "get_real_path") else location.get_real_path())
+        fingerprint = workspace.file_fingerprint(realpath)
+        blockstate = workspace.blockstate_cache.get(realpath)
+        if blockstate is not None and blockstate.fingerprint == fingerprint:
+            return blockstate
+        with workspace.get_file(realpath) as f:
+            blockstate = cls.from_json(json.load(f))
+        blockstate.location = realpath
+        blockstate.fingerprint = fingerprint
+        workspace.blockstate_cache.put(realpath, blockstate)
+        return blockstate
+
+    @classmethod
+    def for_block(cls, workspace: Workspace, block):
+        """
+        Load the blockstate of a block
+
+        :param workspace: workspace to load in
+        :param block: block id, like "minecraft:stone" (or just "stone")
+        :rtype: BlockState
+        """
+        return cls.load_from_file(workspace, DomainResourceLocation("blockstates", block, filetype=".json"))
+
+    @classmethod
+    def from_json(cls, data):
+        """
+        Compile a blockstate
+
+        :param data: the parsed json
+        :rtype: BlockState
+        """
+        self = cls()
+        variants = [(self._parse_key(k), self._parse_variants(v)) for k, v in data.get("variants", {}).items()]
+        cases = [(case.get("when", {}), self._parse_variants(case["apply"])) for case in data.get("multipart", ())]
+        for case in cases:
+            self._collect_values(case[0])
+        for name, values in list(self.properties.items()):
+            if set(values) < {"true", "false"}:  # booleans have both values, even if the file only checks one
+                self._intern(name, "false" if values == ["true"] else "true")
+
+        bit = 0
+        for name, values in self.properties.items():
+            self._bits[name] = bit
+            bit += len(values) + 1
+
+        groups = {}
+        for key, choices in variants:
+            names = tuple(sorted(key))
+            table = groups.setdefault(names, {})
+            table.setdefault(tuple(self._value_ids[x][key[x]] for x in names), choices)  # first one wins
+        self._variant_groups = list(groups.items())
+        self._multipart = [(self._compile_when(when), choices) for when, choices in cases]
+        return self
+
+    def _intern(self, name, value):
+        ids = self._value_ids.setdefault(name, {})
+        if value not in ids:
+            ids[value] = len(ids)
+            self.properties.setdefault(name, []).append(value)
+        return ids[value]
+
+    def _parse_key(self, key):
+        """
+        Parse a variant key, interning its values
+
+        :return: dict of property names to values
+        """
+        properties = {}
+        for pair in key.split(","):
+            if "=" in pair:  # old files use "normal" for blocks without properties
+                name, value = pair.split("=", 1)
+                properties[name] = value
+                self._intern(name, value)
+        return properties
+
+    @staticmethod
+    def _parse_variants(data):
+        """
+        :return: tuple of variants to pick from
+        """
+        if isinstance(data, list):
+            return tuple(Variant.from_json(x) for x in data)
+        return Variant.from_json(data),
+
+    def _collect_values(self, when):
+        """
+        Intern the values used in a multipart condition
+        """
+        for name, values in when.items():
+            if name in ("OR", "AND"):
+                for x in values:
+                    self._collect_values(x)
+            else:
+                for value in _value_string(values).lstrip("!").split("|"):
+                    self._intern(name, value)
+
+    def _compile_when(self, when):
+        """
+        Compile a multipart condition
+
+        :return: list of masks of disallowed bits, the condition is true if any of them doesn't overlap the state
+        """
+        if "OR" in when:
+            return [mask for x in when["OR"] for mask in self._compile_when(x)]
+        if "AND" in when:
+            masks = [0]
+            for x in when["AND"]:
+                masks = [a | b for a in masks for b in self._compile_when(x)]
+            return masks
+        mask = 0
+        for name, values in when.items():
+            values = _value_string(values)
+            negate = values.startswith("!")
+            allowed = {self._value_ids[name][x] for x in values.lstrip("!").split("|")}
+            for i in range(len(self.properties[name]) + 1):
+                if (i in allowed) == negate:
+                    mask |= 1 << (self._bits[name] + i)
+        return [mask]
+
+    def _ids(self, properties):
+        """
+        Intern a state's values, anything the file never mentions is -1
+        """
+        return {k: self._value_ids[k].get(_value_string(v), -1) for k, v in properties.items() if k in self._value_ids}
+
+    def resolve(self, properties, seed=None):
+        """
+        Work out which models a state uses
+
+        :param properties: dict of property names to values
+        :param seed: where there's a list of variants to pick from, pick randomly (by weight) with this seed, instead
+                     of taking the first
+        :return: list of :py:class:`Variant`, empty if nothing matches
+        """
+        ids = self._ids(properties)
+        found = []
+        for names, table in self._variant_groups:
+            choices = table.get(tuple(ids.get(x, -1) for x in names))
+            if choices is not None:
+                found.append(choices)
+                break
+        if self._multipart:
+            state = 0
+            for name, bit in self._bits.items():
+                value = ids.get(name, -1)
+                state |= 1 << (bit + (value if value != -1 else len(self.properties[name])))
+            found.extend(choices for masks, choices in self._multipart if any(not state & x for x in masks))
+
+        if seed is None:
+            return [x[0] for x in found]
+        rng = random.Random(seed)
+        return [x[0] if len(x) == 1 else rng.choices(x, weights=[v.weight for v in x])[0] for x in found]
+
+    def states(self):
+        """
+        Every combination of the property values mentioned in the file
+
+        :return: iterator of dicts of property names to values
+        """
+        names = list(self.properties)
+        for values in itertools.product(*(self.properties[x] for x in names)):
+            yield dict(zip(names, values))
+
+    def load_model(self, workspace: Workspace, properties, seed=None):
+        """
+        Load the model for a state: every model it uses, rotated and put together into one.
+
+        :param workspace: workspace to load models from
+        :param properties: dict of property names to values
+        :param seed: see resolve
+        :return: the model, or None if the state has no models
+        :rtype: BlockModel
+        """
+        models = [BlockModel.load_from_file(workspace, x.model).apply_state(x)
+                  for x in self.resolve(properties, seed)]
+        if len(models) <= 1:
+            return models[0] if models else None
+
+        # multipart: rename texture variables so the parts can't clash
+        model = BlockModel()
+        model.cubes = []
+        for i, part in enumerate(models):
+            part._update_textures()
+            model.textures.update((f"{i}/{k}", v) for k, v in part.textures.items())
+            model.cubes.extend(x.copy(texture_prefix=f"{i}/") for x in part.cubes or ())
+        model.transforms = models[0].transforms
+        model.location = self.location
+        model.variant = tuple((x.location, x.variant) for x in models)
+        model.source_chain = [(self.location, self.fingerprint)] + [x for part in models for x in part.source_chain]
+        return model
+
+
+def find_blockstates(workspace: Workspace):
+    """
+    Find every blockstate file in a workspace
+
+    :return: sorted list of paths
+    """
+    return sorted(set(x for x in workspace.list_files()
+                      if x.startswith("assets/") and "/blockstates/" in x and x.endswith(".json")))
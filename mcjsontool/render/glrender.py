@@ -1,26 +1,91 @@
+import collections
 import ctypes
+import os
+
 import glm
 
 import OpenGL.GL as GL
 import numpy as np
-from PyQt5.QtCore import QThread, pyqtSignal, QObject, pyqtSlot
-from PyQt5.QtGui import QImage, QOpenGLContext, QOpenGLShaderProgram, QOpenGLShader, QSurface, QOpenGLVersionProfile, \
-    QOffscreenSurface, QSurfaceFormat
+from PyQt5.QtCore import QThread, pyqtSignal, QObject, pyqtSlot, QTimer
+from PyQt5.QtGui import QImage, QOpenGLContext, QSurface, QOffscreenSurface, QSurfaceFormat
 from queue import Queue
 
+from mcjsontool.render.iconcache import IconCache
+from mcjsontool.render.loader import CompiledModel
 from mcjsontool.render.model import BlockModel
+from mcjsontool.render.texture import WorkspaceAtlas, MIP_LEVELS, build_mip_chain
+from mcjsontool.resource.cache import LRUCache
 from mcjsontool.resource.workspace import Workspace
 
+SHADER_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "shader")
+
+
+def create_framebuffer(width, height):
+    """
+    Create a framebuffer with a color texture and depth buffer
+
+    :return: fbo, texture, renderbuffer
+    """
+    tex = GL.glGenTextures(1)
+    fbo = GL.glGenFramebuffers(1)
+    rbuf = GL.glGenRenderbuffers(1)
+
+    GL.glBindTexture(GL.GL_TEXTURE_2D, tex)
+    GL.glTexParameteri(GL.GL_TEXTURE_2D, GL.GL_TEXTURE_MAG_FILTER, GL.GL_NEAREST)
+    GL.glTexParameteri(GL.GL_TEXTURE_2D, GL.GL_TEXTURE_MIN_FILTER, GL.GL_NEAREST)
+    GL.glTexImage2D(GL.GL_TEXTURE_2D, 0, GL.GL_RGBA, width, height, 0, GL.GL_RGBA, GL.GL_UNSIGNED_BYTE, None)
+
+    GL.glBindRenderbuffer(GL.GL_RENDERBUFFER, rbuf)
+    GL.glRenderbufferStorage(GL.GL_RENDERBUFFER, GL.GL_DEPTH_COMPONENT24, width, height)
+
+    GL.glBindFramebuffer(GL.GL_FRAMEBUFFER, fbo)
+    GL.glFramebufferRenderbuffer(GL.GL_FRAMEBUFFER, GL.GL_DEPTH_ATTACHMENT, GL.GL_RENDERBUFFER, rbuf)
+    GL.glFramebufferTexture2D(GL.GL_FRAMEBUFFER, GL.GL_COLOR_ATTACHMENT0, GL.GL_TEXTURE_2D, tex, 0)
+    if GL.glCheckFramebufferStatus(GL.GL_FRAMEBUFFER) != GL.GL_FRAMEBUFFER_COMPLETE:
+        raise RuntimeError("Framebuffer is not complete!")
+    GL.glBindFramebuffer(GL.GL_FRAMEBUFFER, 0)
+    GL.glBindRenderbuffer(GL.GL_RENDERBUFFER, 0)
+    return fbo, tex, rbuf
+
+
+def compile_program(vertex_path, fragment_path):
+    """
+    Compile and link a shader program with plain gl calls, so it works in any current context (Qt's or a headless one)
+
+    :param vertex_path: vertex shader, relative to SHADER_DIR
+    :param fragment_path: fragment shader, relative to SHADER_DIR
+    :return: the program
+    """
+    program = GL.glCreateProgram()
+    for kind, path in ((GL.GL_VERTEX_SHADER, vertex_path), (GL.GL_FRAGMENT_SHADER, fragment_path)):
+        with open(os.path.join(SHADER_DIR, path)) as f:
+            source = f.read()
+        shader = GL.glCreateShader(kind)
+        GL.glShaderSource(shader, source)
+        GL.glCompileShader(shader)
+        if not GL.glGetShaderiv(shader, GL.GL_COMPILE_STATUS):
+            raise RuntimeError("Couldn't compile {}: {}".format(path, GL.glGetShaderInfoLog(shader).decode()))
+        GL.glAttachShader(program, shader)
+        GL.glDeleteShader(shader)  # only actually deleted along with the program
+    GL.glLinkProgram(program)
+    if not GL.glGetProgramiv(program, GL.GL_LINK_STATUS):
+        raise RuntimeError("Couldn't link shader: {}".format(GL.glGetProgramInfoLog(program).decode()))
+    return program
+
 
 class OffscreenModelRendererThread(QThread):
     TEX_SIZE = 128
+    BATCH_TILES = 8  # batch renders draw into a BATCH_TILES x BATCH_TILES grid of icons
+    BATCH_EMIT_SIZE = 16  # how many icons go in each renderedTextures signal
     renderedTexture = pyqtSignal(str, QImage)
+    renderedTextures = pyqtSignal(list)
 
     def __init__(self, parent_screen):
         super().__init__()
         self.parent_screen = parent_screen
         self.started.connect(self.started_)
         self.workspace = None
+        self.icon_cache = IconCache()
         self.offscreen_surface = QOffscreenSurface()
         self.offscreen_surface.requestedFormat().setVersion(4, 3)
         self.offscreen_surface.requestedFormat().setProfile(QSurfaceFormat.CoreProfile)
@@ -43,33 +108,69 @@ class OffscreenModelRendererThread(QThread):
     @pyqtSlot(Workspace)
     def setWorkspace(self, w):
         if hasattr(self, "renderer"):
+            self.ctx.makeCurrent(self.offscreen_surface)  # switching workspaces frees the renderer's meshes
             self.renderer.set_workspace(w)
         else:
             self.workspace = w
 
     def setup_fbo(self):
         self.ctx.makeCurrent(self.offscreen_surface)
-        self.tex = GL.glGenTextures(1)
-        self.fbo = GL.glGenFramebuffers(1)
-        self.rbuf = GL.glGenRenderbuffers(1)
+        size = OffscreenModelRendererThread.TEX_SIZE
+        self.fbo, self.tex, self.rbuf = create_framebuffer(size, size)
+        batch_size = size * OffscreenModelRendererThread.BATCH_TILES
+        self.batch_fbo, self.batch_tex, self.batch_rbuf = create_framebuffer(batch_size, batch_size)
+        self.readback = AsyncReadback(batch_size * batch_size * 4)
+        self._flush_scheduled = False
+        self._batch_results = []
+
+    @staticmethod
+    def _qimage_for(pixels):
+        """
+        Make a QImage from pixels read back from gl (which are bottom up, QImage is top down)
+        """
+        height, width = pixels.shape[:2]
+        return QImage(pixels[::-1].tobytes(), width, height, width * 4, QImage.Format_RGBA8888).copy()
 
-        GL.glBindTexture(GL.GL_TEXTURE_2D, self.tex)
-        GL.glTexParameteri(GL.GL_TEXTURE_2D, GL.GL_TEXTURE_MAG_FILTER, GL.GL_NEAREST)
-        GL.glTexParameteri(GL.GL_TEXTURE_2D, GL.GL_TEXTURE_MIN_FILTER, GL.GL_NEAREST)
-        GL.glTexImage2D(GL.GL_TEXTURE_2D, 0, GL.GL_RGBA, OffscreenModelRendererThread.TEX_SIZE,
-                        OffscreenModelRendererThread.TEX_SIZE, 0, GL.GL_RGBA, GL.GL_UNSIGNED_BYTE, None)
+    def _schedule_flush(self):
+        """
+        Make sure pending readbacks get finished once the orders queued up right now have been drawn
+        """
+        if not self._flush_scheduled:
+            self._flush_scheduled = True
+            QTimer.singleShot(0, self.flush_readbacks)
 
-        GL.glBindRenderbuffer(GL.GL_RENDERBUFFER, self.rbuf)
-        GL.glRenderbufferStorage(GL.GL_RENDERBUFFER, GL.GL_DEPTH_COMPONENT24, OffscreenModelRendererThread.TEX_SIZE,
-                                 OffscreenModelRendererThread.TEX_SIZE)
+    def _icon_key(self, model):
+        """
+        :return: the model's key in the icon cache, or None if it can't have one
+        """
+        try:
+            return self.icon_cache.key_for(self.renderer.workspace, model, "gui", OffscreenModelRendererThread.TEX_SIZE)
+        except (FileNotFoundError, KeyError, ValueError):
+            return None
+
+    def _finish_icon(self, key, pixels):
+        image = self._qimage_for(pixels)
+        if key is not None:
+            self.icon_cache.put(key, image)
+        return image
+
+    def _add_batch_result(self, order_name, image):
+        self._batch_results.append((order_name, image))
+        if len(self._batch_results) == OffscreenModelRendererThread.BATCH_EMIT_SIZE:
+            self.renderedTextures.emit(self._batch_results)
+            self._batch_results = []
 
-        GL.glBindFramebuffer(GL.GL_FRAMEBUFFER, self.fbo)
-        GL.glFramebufferRenderbuffer(GL.GL_FRAMEBUFFER, GL.GL_DEPTH_ATTACHMENT, GL.GL_RENDERBUFFER, self.rbuf)
-        GL.glFramebufferTexture2D(GL.GL_FRAMEBUFFER, GL.GL_COLOR_ATTACHMENT0, GL.GL_TEXTURE_2D, self.tex, 0)
-        if GL.glCheckFramebufferStatus(GL.GL_FRAMEBUFFER) != GL.GL_FRAMEBUFFER_COMPLETE:
-            raise RuntimeError("Framebuffer is not complete!")
-        GL.glBindFramebuffer(GL.GL_FRAMEBUFFER, 0)
-        GL.glBindRenderbuffer(GL.GL_RENDERBUFFER, 0)
+    @pyqtSlot()
+    def flush_readbacks(self):
+        """
+        Wait for every pending readback, emitting their images
+        """
+        self._flush_scheduled = False
+        self.ctx.makeCurrent(self.offscreen_surface)
+        self.readback.flush()
+        if self._batch_results:
+            self.renderedTextures.emit(self._batch_results)
+            self._batch_results = []
 
     @pyqtSlot(str, BlockModel)
     def queue_render_order(self, order_name, model):
@@ -78,103 +179,424 @@ class OffscreenModelRendererThread(QThread):
 
         Pass in an order name so you know which image you got back
 
+        The image is read back asynchronously (see :py:class:`AsyncReadback`), so it gets emitted a little later,
+        once the GPU is done with it (at the latest once the event loop is idle). Icons already in the icon cache
+        are emitted straight away without rendering.
+
         :param order_name: the order name. passed to renderedTexture
         :param model: the blockmodel
         :return:
         """
+        key = self._icon_key(model)
+        if key is not None:
+            image = self.icon_cache.get(key)
+            if image is not None:
+                self.renderedTexture.emit(order_name, image)
+                return
+
         self.ctx.makeCurrent(self.offscreen_surface)
         GL.glBindFramebuffer(GL.GL_FRAMEBUFFER, self.fbo)
         GL.glViewport(0, 0, OffscreenModelRendererThread.TEX_SIZE, OffscreenModelRendererThread.TEX_SIZE)
         GL.glClearColor(0, 0, 0, 0)
         GL.glClear(GL.GL_DEPTH_BUFFER_BIT | GL.GL_COLOR_BUFFER_BIT)
-        self.renderer.setup_data_for_block_model(model)
-        self.renderer.resize(OffscreenModelRendererThread.TEX_SIZE, OffscreenModelRendererThread.TEX_SIZE)
-        self.renderer.draw_loaded_model(glm.lookAt(glm.vec3(15, 5, 5), glm.vec3(5, 5, 5), glm.vec3(0, 1, 0)), "gui",
-                                        glm.ortho(-10, 10, 10, -10, 0.1, 50))
-        tex_str = GL.glReadPixels(0, 0, OffscreenModelRendererThread.TEX_SIZE, OffscreenModelRendererThread.TEX_SIZE,
-                                  GL.GL_RGBA, GL.GL_UNSIGNED_BYTE, outputType=bytes)
+        self.renderer.draw_model_icon(model)
+        self.readback.read(0, 0, OffscreenModelRendererThread.TEX_SIZE, OffscreenModelRendererThread.TEX_SIZE,
+                           lambda pixels: self.renderedTexture.emit(order_name, self._finish_icon(key, pixels)))
         GL.glBindFramebuffer(GL.GL_FRAMEBUFFER, 0)
-        qimage = QImage(tex_str, OffscreenModelRendererThread.TEX_SIZE, OffscreenModelRendererThread.TEX_SIZE,
-                        OffscreenModelRendererThread.TEX_SIZE * 4, QImage.Format_RGBA8888)
-        qimage = qimage.mirrored(vertical=True)
-        self.renderedTexture.emit(order_name, qimage)
+        self.readback.poll()
+        self._schedule_flush()
+
+    def _emit_batch_tiles(self, drawn, pixels):
+        """
+        Slice the icons out of a batch readback
+
+        :param drawn: list of (tile number, order name, icon cache key)
+        :param pixels: the readback
+        """
+        size = OffscreenModelRendererThread.TEX_SIZE
+        tiles = OffscreenModelRendererThread.BATCH_TILES
+        for i, order_name, key in drawn:
+            x, y = (i % tiles) * size, (i // tiles) * size
+            self._add_batch_result(order_name, self._finish_icon(key, pixels[y:y + size, x:x + size]))
+
+    @pyqtSlot(list)
+    def queue_batch_render(self, orders):
+        """
+        Render lots of block models in item format at once. Subscribe to renderedTextures to get them back, as lists
+        of (order name, QImage) of up to BATCH_EMIT_SIZE.
+
+        Models are drawn into tiles of one big framebuffer, which is read back once for every BATCH_TILES² models
+        instead of once per model. Readbacks are asynchronous, so one pass is copied back while the next is drawn.
+        Icons already in the icon cache are emitted first, without rendering. Models that fail to load are skipped.
+
+        :param orders: list of (order name, blockmodel)
+        """
+        size = OffscreenModelRendererThread.TEX_SIZE
+        tiles = OffscreenModelRendererThread.BATCH_TILES
+        to_render = []
+        for order_name, model in orders:
+            key = self._icon_key(model)
+            image = self.icon_cache.get(key) if key is not None else None
+            if image is not None:
+                self._add_batch_result(order_name, image)
+            else:
+                to_render.append((order_name, model, key))
+        orders = to_render
+
+        self.ctx.makeCurrent(self.offscreen_surface)
+        GL.glBindFramebuffer(GL.GL_FRAMEBUFFER, self.batch_fbo)
+        GL.glClearColor(0, 0, 0, 0)
+
+        for start in range(0, len(orders), tiles * tiles):
+            chunk = orders[start:start + tiles * tiles]
+            GL.glViewport(0, 0, tiles * size, tiles * size)
+            GL.glClear(GL.GL_DEPTH_BUFFER_BIT | GL.GL_COLOR_BUFFER_BIT)
+            drawn = []
+            for i, (order_name, model, key) in enumerate(chunk):
+                GL.glViewport((i % tiles) * size, (i // tiles) * size, size, size)
+                try:
+                    self.renderer.draw_model_icon(model)
+                except (FileNotFoundError, KeyError, ValueError):
+                    continue
+                drawn.append((i, order_name, key))
+
+            rows = -(-len(chunk) // tiles)  # only read back the rows that were drawn to
+            self.readback.read(0, 0, tiles * size, rows * size,
+                               lambda pixels, drawn=drawn: self._emit_batch_tiles(drawn, pixels))
+            self.readback.poll()
+
+        GL.glBindFramebuffer(GL.GL_FRAMEBUFFER, 0)
+        self.flush_readbacks()
+
+
+class AsyncReadback:
+    """
+    Reads pixels back from the GPU through a ring of pixel buffer objects.
+
+    glReadPixels into client memory waits for everything drawn before it to finish. Reading into a PBO instead just
+    queues a copy, so drawing can carry on; a fence tells us when the copy is done and the PBO can be mapped.
+    Callbacks are always called in the order the reads were started.
+    """
+
+    RING_SIZE = 3
+
+    def __init__(self, max_bytes, ring_size=None):
+        """
+        Create the PBOs. Needs a current context.
+
+        :param max_bytes: size of the biggest read
+        :param ring_size: how many reads can be in flight, defaults to RING_SIZE
+        """
+        self.max_bytes = max_bytes
+        self.free = list(GL.glGenBuffers(ring_size or AsyncReadback.RING_SIZE))
+        for pbo in self.free:
+            GL.glBindBuffer(GL.GL_PIXEL_PACK_BUFFER, pbo)
+            GL.glBufferData(GL.GL_PIXEL_PACK_BUFFER, max_bytes, None, GL.GL_STREAM_READ)
+        GL.glBindBuffer(GL.GL_PIXEL_PACK_BUFFER, 0)
+        self.pending = collections.deque()  # (pbo, fence, width, height, callback)
+
+    def read(self, x, y, width, height, callback):
+        """
+        Start reading RGBA pixels from the current framebuffer. If every PBO is busy, waits for the oldest read.
+
+        :param callback: called with the pixels as a (height, width, 4) uint8 array (bottom row first) once done
+        """
+        if width * height * 4 > self.max_bytes:
+            raise ValueError("Read is bigger than the readback buffers")
+        if not self.free:
+            self._finish(wait=True)
+        pbo = self.free.pop()
+        GL.glBindBuffer(GL.GL_PIXEL_PACK_BUFFER, pbo)
+        GL.glReadPixels(x, y, width, height, GL.GL_RGBA, GL.GL_UNSIGNED_BYTE, ctypes.c_void_p(0))
+        GL.glBindBuffer(GL.GL_PIXEL_PACK_BUFFER, 0)
+        fence = GL.glFenceSync(GL.GL_SYNC_GPU_COMMANDS_COMPLETE, 0)
+        GL.glFlush()  # make sure the fence actually gets to the GPU
+        self.pending.append((pbo, fence, width, height, callback))
+
+    def poll(self):
+        """
+        Finish every read that is already done, without waiting
+        """
+        while self.pending and GL.glClientWaitSync(self.pending[0][1], 0, 0) in (GL.GL_ALREADY_SIGNALED,
+                                                                                 GL.GL_CONDITION_SATISFIED):
+            self._finish(wait=False)
+
+    def flush(self):
+        """
+        Wait for and finish every pending read
+        """
+        while self.pending:
+            self._finish(wait=True)
+
+    def _finish(self, wait):
+        pbo, fence, width, height, callback = self.pending.popleft()
+        if wait:
+            while GL.glClientWaitSync(fence, GL.GL_SYNC_FLUSH_COMMANDS_BIT, 1000000000) == GL.GL_TIMEOUT_EXPIRED:
+                pass
+        GL.glDeleteSync(fence)
+
+        size = width * height * 4
+        GL.glBindBuffer(GL.GL_PIXEL_PACK_BUFFER, pbo)
+        pointer = GL.glMapBufferRange(GL.GL_PIXEL_PACK_BUFFER, 0, size, GL.GL_MAP_READ_BIT)
+        pixels = np.ctypeslib.as_array((ctypes.c_ubyte * size).from_address(pointer)).reshape((height, width, 4)).copy()
+        GL.glUnmapBuffer(GL.GL_PIXEL_PACK_BUFFER)
+        GL.glBindBuffer(GL.GL_PIXEL_PACK_BUFFER, 0)
+        self.free.append(pbo)
+        callback(pixels)
+
+
+class GPUMesh:
+    """
+    A model's mesh uploaded to the GPU: a VAO with an interleaved vertex buffer and an index buffer. Meshes for models
+    that have their own atlas (instead of using the shared one) own that texture too.
+    """
+
+    def __init__(self, vertices, indices, texture=-1, texture_bytes=0):
+        """
+        Upload a mesh. Needs a current context.
+
+        :param vertices: float32 array from BlockModel.compile_to_indexed
+        :param indices: index array from BlockModel.compile_to_indexed
+        :param texture: texture this mesh owns (deleted with it), or -1 for none
+        :param texture_bytes: size of that texture, for the VRAM budget
+        """
+        self.vao = GL.glGenVertexArrays(1)
+        self.vbo, self.ebo = GL.glGenBuffers(2)
+        self.texture = texture
+        self.count = len(indices)
+        self.index_type = GL.GL_UNSIGNED_SHORT if indices.dtype == np.uint16 else GL.GL_UNSIGNED_INT
+        self.nbytes = vertices.nbytes + indices.nbytes + texture_bytes
+
+        GL.glBindVertexArray(self.vao)
+        GL.glBindBuffer(GL.GL_ARRAY_BUFFER, self.vbo)
+        GL.glBufferData(GL.GL_ARRAY_BUFFER, vertices.nbytes, vertices, GL.GL_STATIC_DRAW)
+        GL.glBindBuffer(GL.GL_ELEMENT_ARRAY_BUFFER, self.ebo)
+        GL.glBufferData(GL.GL_ELEMENT_ARRAY_BUFFER, indices.nbytes, indices, GL.GL_STATIC_DRAW)
+        GL.glEnableVertexAttribArray(0)
+        GL.glEnableVertexAttribArray(1)
+        GL.glEnableVertexAttribArray(2)
+        stride = vertices.strides[0]
+        GL.glVertexAttribPointer(0, 4, GL.GL_FLOAT, GL.GL_FALSE, stride, ctypes.c_void_p(0))
+        GL.glVertexAttribPointer(1, 2, GL.GL_FLOAT, GL.GL_FALSE, stride, ctypes.c_void_p(4 * 4))
+        GL.glVertexAttribPointer(2, 3, GL.GL_FLOAT, GL.GL_FALSE, stride, ctypes.c_void_p(6 * 4))
+        GL.glBindVertexArray(0)
+
+    def draw(self):
+        GL.glBindVertexArray(self.vao)
+        GL.glDrawElements(GL.GL_TRIANGLES, self.count, self.index_type, ctypes.c_void_p(0))
+
+    def delete(self):
+        """
+        Free the GPU objects. Needs the context the mesh was created in to be current.
+        """
+        GL.glDeleteVertexArrays(1, [self.vao])
+        GL.glDeleteBuffers(2, [self.vbo, self.ebo])
+        if self.texture != -1:
+            GL.glDeleteTextures([self.texture])
 
 
 class ModelRenderer(QObject):
+    MESH_CACHE_BYTES = 64 * 1024 * 1024
+    ICON_VIEW = glm.lookAt(glm.vec3(15, 5, 5), glm.vec3(5, 5, 5), glm.vec3(0, 1, 0))
+    ICON_PROJECTION = glm.ortho(-10, 10, 10, -10, 0.1, 50)
+    TICKS_PER_SECOND = 20
+
     """
     The ModelRenderer wraps an opengl context so you can draw models to it. Currently supports blockmodels.
 
-    You need: an opengl surface, an opengl context and a workspace instance.
+    You need: a current opengl context and a workspace instance. The surface is optional (it's only used for the
+    aspect ratio), so this works in headless contexts too.
+
+    Uploaded meshes are kept in a cache (budgeted by how much VRAM they use), so setting up a model that was drawn
+    recently is just a lookup.
+
+    Animated textures are animated by the shader: set time (in ticks, TICKS_PER_SECOND of them a second) before
+    drawing, nothing else has to change.
+
+    For scenes with lots of small (far away) models, turn on mipmaps: atlases are then padded and get MIP_LEVELS
+    mipmaps, so minified textures read less memory and don't shimmer. compress asks the driver to store textures
+    compressed, which trades a bit of quality for a quarter or so of the VRAM (if the driver supports it at all).
+    Icons are drawn bigger than their textures, so neither helps them.
     """
 
-    def __init__(self, workspace, surface: QSurface):
+    def __init__(self, workspace, surface: QSurface = None, shared_atlas=True, mipmaps=False, compress=False):
+        """
+        :param workspace: workspace to load from
+        :param surface: the surface being drawn to, or None
+        :param shared_atlas: put textures in the workspace-wide atlas (see :py:class:`WorkspaceAtlas`), instead of
+                             building and uploading an atlas for every model
+        :param mipmaps: build and use mipmapped atlases (models from setup_data_for_compiled aren't mipmapped)
+        :param compress: upload textures with a generic compressed internal format
+        """
         super().__init__()
 
         self.surf = surface
-        prof = QOpenGLVersionProfile()
-        prof.setVersion(2, 0)
-
-        self.vao = GL.glGenVertexArrays(1)
-        self.vbo, self.vbo2 = GL.glGenBuffers(2)
 
-        self.texture = -1
         self.current_model: BlockModel = None
+        self.current_mesh: GPUMesh = None
+        self.current_mesh_cached = False
         self.workspace = workspace
+        self.mesh_cache = LRUCache(ModelRenderer.MESH_CACHE_BYTES, sizeof=lambda x: x.nbytes,
+                                   on_evict=lambda key, mesh: self._free_mesh(mesh))
 
-        self.array1, array2 = None, None
-
-        self.shader = QOpenGLShaderProgram()
-        self.shader.addShaderFromSourceFile(QOpenGLShader.Vertex, "shader/block.vertex.glsl")
-        self.shader.addShaderFromSourceFile(QOpenGLShader.Fragment, "shader/block.fragment.glsl")
-        self.shader.link()
+        self.shader = compile_program("block.vertex.glsl", "block.fragment.glsl")
 
-        self.proj_mat = glm.perspective(1.57, self.surf.size().width() / self.surf.size().height(), 0.1, 100)
-        self.texture = GL.glGenTextures(1)
+        if surface is not None:
+            self.resize(surface.size().width(), surface.size().height())
+        else:
+            self.resize(1, 1)
+        self.texture = GL.glGenTextures(1)  # the shared atlas
+        self.uv_scale = (1, 1)
+        self.time = 0  # animation time, in ticks
+
+        self.use_shared_atlas = shared_atlas
+        self.mip_levels = MIP_LEVELS if mipmaps else 0
+        self.internal_format = GL.GL_COMPRESSED_RGBA if compress else GL.GL_RGBA
+        self.shared_atlas = None
+        self.atlas_generation = -1  # generation of the shared atlas in self.texture
+        self.atlas_uploaded = 0  # how many of its updates have been uploaded
+        self.atlas_changes = None  # changes of the shared atlas when the current model was set up
+        if workspace is not None:
+            self.set_workspace(workspace)
 
     def set_workspace(self, workspace):
+        """
+        Switch to another workspace, freeing the cached meshes. Needs the renderer's context to be current.
+        """
         self.workspace = workspace
+        self.shared_atlas = None if workspace is None else WorkspaceAtlas.for_workspace(workspace, self.mip_levels)
+        self.atlas_generation = -1
+        self.mesh_cache.clear()
+
+    def _free_mesh(self, mesh):
+        if mesh is self.current_mesh:
+            self.current_mesh_cached = False  # still being drawn, freed when it's replaced
+        else:
+            mesh.delete()
+
+    def _sync_shared_atlas(self):
+        """
+        Bring the atlas texture up to date with the shared atlas, uploading only what changed
+        """
+        atlas = self.shared_atlas
+        with atlas.lock:
+            if self.atlas_generation != atlas.generation:
+                self._upload_texture(self.texture, atlas.mip_chain())
+                self.atlas_generation = atlas.generation
+            else:
+                GL.glBindTexture(GL.GL_TEXTURE_2D, self.texture)
+                # compressed textures can only be updated in 4x4 blocks, so round updates out to a size that's still
+                # whole blocks on the smallest mipmap. that's also aligned to every level, so the mipmaps of just the
+                # updated bit come out the same as the whole atlas'
+                block = 4 << atlas.mip_levels
+                for x, y, w, h in atlas.updates[self.atlas_uploaded:]:
+                    right, bottom = -(-(x + w) // block) * block, -(-(y + h) // block) * block
+                    x, y = x - x % block, y - y % block
+                    w, h = right - x, bottom - y
+                    chain = build_mip_chain(np.ascontiguousarray(atlas.data[y:y + h, x:x + w]), atlas.mip_levels)
+                    for level, pixels in enumerate(chain):
+                        GL.glTexSubImage2D(GL.GL_TEXTURE_2D, level, x >> level, y >> level, w >> level, h >> level,
+                                           GL.GL_RGBA, GL.GL_UNSIGNED_BYTE, pixels)
+            self.atlas_uploaded = len(atlas.updates)
+            self.uv_scale = atlas.uv_scale
+
+    def _upload_texture(self, texture, chain):
+        """
+        Upload an image and its mipmaps to a texture, with nearest filtering (blending between mipmaps if there are
+        any)
+
+        :param texture: the texture
+        :param chain: list of uint8 arrays of shape (h, w, 4), the full size image first (see build_mip_chain)
+        :return: roughly how many bytes it uses
+        """
+        GL.glBindTexture(GL.GL_TEXTURE_2D, texture)
+        GL.glTexParameteri(GL.GL_TEXTURE_2D, GL.GL_TEXTURE_MAG_FILTER, GL.GL_NEAREST)
+        GL.glTexParameteri(GL.GL_TEXTURE_2D, GL.GL_TEXTURE_MIN_FILTER,
+                           GL.GL_NEAREST_MIPMAP_LINEAR if len(chain) > 1 else GL.GL_NEAREST)
+        GL.glTexParameteri(GL.GL_TEXTURE_2D, GL.GL_TEXTURE_MAX_LEVEL, len(chain) - 1)
+        for level, pixels in enumerate(chain):
+            GL.glTexImage2D(GL.GL_TEXTURE_2D, level, self.internal_format, pixels.shape[1], pixels.shape[0], 0,
+                            GL.GL_RGBA, GL.GL_UNSIGNED_BYTE, pixels)
+        return sum(x.nbytes for x in chain)
+
+    def _upload_model_atlas(self, atlas):
+        """
+        Upload a model's own atlas to a new texture
+
+        :return: the texture, its size in bytes
+        """
+        texture = GL.glGenTextures(1)
+        return texture, self._upload_texture(texture, atlas.mip_chain())
 
     def setup_data_for_block_model(self, model: BlockModel):
         """
         Setup the vbo & texture for a block model
 
-        todo: optimize for repeats
+        Meshes are cached by the model's location, variant and file fingerprints (plus where its textures are), so
+        this only compiles and uploads models that haven't been drawn recently.
 
         You probably should call render after using this function
         :param model: the blockmodel to setup for
         """
         self.current_model = model
-        print(self.workspace)
-        atlas = model.create_model_atlas(self.workspace)
-        GL.glBindTexture(GL.GL_TEXTURE_2D, self.texture)
-        GL.glTexParameteri(GL.GL_TEXTURE_2D, GL.GL_TEXTURE_MAG_FILTER, GL.GL_NEAREST)
-        GL.glTexParameteri(GL.GL_TEXTURE_2D, GL.GL_TEXTURE_MIN_FILTER, GL.GL_NEAREST)
-        GL.glTexImage2D(GL.GL_TEXTURE_2D, 0, GL.GL_RGBA, atlas.size[0], atlas.size[1], 0, GL.GL_RGBA,
-                        GL.GL_UNSIGNED_BYTE, atlas.data)
-        verts, uvs = model.compile_to_vertex_list(atlas)
-        verts = list(map(lambda x: list(x), verts))
-        uvs = list(map(lambda x: list(x), uvs))
-        GL.glBindVertexArray(self.vao)
-        GL.glBindBuffer(GL.GL_ARRAY_BUFFER, self.vbo)
-        self.array1 = np.array(verts, dtype=np.float32).ravel()
-        self.array2 = np.array(uvs, dtype=np.float32).ravel()
-        GL.glBufferData(GL.GL_ARRAY_BUFFER, self.array1.size * 4, self.array1, GL.GL_DYNAMIC_DRAW)
-        GL.glEnableVertexAttribArray(0)
-        GL.glEnableVertexAttribArray(1)
-        GL.glVertexAttribPointer(0, 4, GL.GL_FLOAT, GL.GL_FALSE, 0, ctypes.c_void_p(0))
-        GL.glBindBuffer(GL.GL_ARRAY_BUFFER, self.vbo2)
-        GL.glBufferData(GL.GL_ARRAY_BUFFER, self.array1.size * 4, self.array2, GL.GL_DYNAMIC_DRAW)
-        GL.glVertexAttribPointer(1, 2, GL.GL_FLOAT, GL.GL_FALSE, 0, ctypes.c_void_p(0))
-        GL.glBindVertexArray(0)
-        self.array_size = len(verts)
-        self.array = verts
+        atlas = None
+        if self.use_shared_atlas:
+            atlas = self.shared_atlas.add_model(model, self.workspace)
+            self.atlas_changes = self.shared_atlas.changes
+            self._sync_shared_atlas()
+            texture_state = tuple(sorted(atlas.rects.items())), tuple(sorted(atlas.animations.items()))
+        else:
+            texture_state = model.texture_fingerprints(self.workspace)
+        key = None if model.cache_key is None else (model.cache_key, self.use_shared_atlas, texture_state)
+
+        mesh = None if key is None else self.mesh_cache.get(key)
+        if mesh is None:
+            texture, texture_bytes = -1, 0
+            if atlas is None:
+                atlas = model.create_model_atlas(self.workspace, self.mip_levels)
+                texture, texture_bytes = self._upload_model_atlas(atlas)
+            mesh = GPUMesh(*model.compile_to_indexed(atlas), texture, texture_bytes)
+            if key is not None:
+                self.mesh_cache.put(key, mesh)
+
+        self._set_current_mesh(mesh, key)
+
+    def setup_data_for_compiled(self, compiled: CompiledModel):
+        """
+        Setup the vbo & texture for a model compiled by a :py:class:`ModelLoaderPool`, which just uploads its arrays.
+
+        The mesh is cached the same way setup_data_for_block_model would cache the model without the shared atlas.
+        You can then draw it with draw_loaded_model, same as a block model.
+
+        :param compiled: the compiled model
+        """
+        self.current_model = compiled
+        key = None if compiled.cache_key is None else (compiled.cache_key, False, compiled.texture_state)
+        mesh = None if key is None else self.mesh_cache.get(key)
+        if mesh is None:
+            texture = GL.glGenTextures(1)
+            texture_bytes = self._upload_texture(texture, [compiled.pixels])
+            mesh = GPUMesh(compiled.vertices, compiled.indices, texture, texture_bytes)
+            if key is not None:
+                self.mesh_cache.put(key, mesh)
+        self._set_current_mesh(mesh, key)
+
+    def _set_current_mesh(self, mesh, key):
+        if self.current_mesh is not None and self.current_mesh is not mesh and not self.current_mesh_cached:
+            self.current_mesh.delete()
+        self.current_mesh = mesh
+        self.current_mesh_cached = key is not None and key in self.mesh_cache
+        if mesh.texture != -1:
+            self.uv_scale = (1, 1)
 
     def _plumb_shader_for(self, proj_view: glm.mat4, model_transform):
-        self.shader.bind()
+        GL.glUseProgram(self.shader)
         GL.glUniformMatrix4fv(1, 1, GL.GL_FALSE, glm.value_ptr(proj_view))
         GL.glUniformMatrix4fv(0, 1, GL.GL_FALSE, glm.value_ptr(model_transform))
-        print(model_transform * self.array[0])
-        GL.glBindTexture(GL.GL_TEXTURE_2D, self.texture)
+        GL.glUniform2f(2, *self.uv_scale)
+        GL.glUniform1f(3, self.time)
+        texture = self.current_mesh.texture
+        GL.glBindTexture(GL.GL_TEXTURE_2D, self.texture if texture == -1 else texture)
 
     def draw_loaded_model(self, view_matrix, transform_name, proj=None):
         """
@@ -189,14 +611,28 @@ class ModelRenderer(QObject):
 
         if proj is None:
             proj = self.proj_mat
-
-        print(self.current_model.transforms[transform_name])
+        if (self.use_shared_atlas and isinstance(self.current_model, BlockModel) and
+                self.atlas_changes != self.shared_atlas.changes):
+            self.setup_data_for_block_model(self.current_model)  # its textures changed or moved since
 
         self._plumb_shader_for(proj * view_matrix, self.current_model.transforms[transform_name])
-        GL.glBindVertexArray(self.vao)
 
         GL.glEnable(GL.GL_DEPTH_TEST)
-        GL.glDrawArrays(GL.GL_TRIANGLES, 0, len(self.array))
+        self.current_mesh.draw()
+
+    def draw_model_icon(self, model):
+        """
+        Setup and draw a block model how it looks as an item (gui transform, looking at it from the side) into the
+        current viewport.
+
+        :param model: the blockmodel, or a CompiledModel
+        """
+        if isinstance(model, CompiledModel):
+            self.setup_data_for_compiled(model)
+        else:
+            self.setup_data_for_block_model(model)
+        self.resize(1, 1)
+        self.draw_loaded_model(ModelRenderer.ICON_VIEW, "gui", ModelRenderer.ICON_PROJECTION)
 
     def resize(self, width, height):
         """
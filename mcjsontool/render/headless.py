@@ -0,0 +1,308 @@
+"""
+Headless icon sheet renderer.
+
+Renders a bunch of models from a workspace into a PNG sprite sheet, with a JSON index of where each icon ended up,
+without opening a window (so it works on build servers). Run it with::
+
+    python -m mcjsontool.render.headless workspace.mcjtwp "minecraft:block/*" -o icons.png
+
+PyOpenGL picks its platform when it's first imported, so this has to set PYOPENGL_PLATFORM before anything imports
+OpenGL. That's why the gl imports live in the functions here.
+"""
+import argparse
+import concurrent.futures
+import ctypes
+import fnmatch
+import json
+import math
+import os
+import sys
+import time
+
+BATCH_PIXELS = 1024  # size of the framebuffer batches are drawn into
+
+
+class HeadlessContext:
+    """
+    An OpenGL 4.3 core context with no window or surface, made current on creation.
+
+    The egl backend uses Mesa's surfaceless platform if it's there (no X or GPU needed), otherwise the default display.
+    The osmesa backend renders in software into a dummy buffer. Either way, draw into framebuffers.
+    """
+
+    def __init__(self, backend="egl"):
+        self.backend = backend
+        if backend == "egl":
+            self._create_egl()
+        elif backend == "osmesa":
+            self._create_osmesa()
+        else:
+            raise ValueError("Unknown backend " + backend)
+
+    def _create_egl(self):
+        from OpenGL import EGL
+
+        self.display = EGL.EGL_NO_DISPLAY
+        try:
+            self.display = EGL.eglGetPlatformDisplayEXT(0x31DD, EGL.EGL_DEFAULT_DISPLAY, None)  # surfaceless mesa
+        except Exception:
+            pass  # no EGL_EXT_platform_base
+        major, minor = EGL.EGLint(), EGL.EGLint()
+        if not self.display or not EGL.eglInitialize(self.display, ctypes.pointer(major), ctypes.pointer(minor)):
+            self.display = EGL.eglGetDisplay(EGL.EGL_DEFAULT_DISPLAY)
+            if not EGL.eglInitialize(self.display, ctypes.pointer(major), ctypes.pointer(minor)):
+                raise RuntimeError("Couldn't initialize EGL")
+
+        config = EGL.EGLConfig()
+        count = EGL.EGLint()
+        attributes = (EGL.EGLint * 5)(EGL.EGL_RENDERABLE_TYPE, EGL.EGL_OPENGL_BIT, EGL.EGL_SURFACE_TYPE, 0,
+                                      EGL.EGL_NONE)
+        if not EGL.eglChooseConfig(self.display, attributes, ctypes.pointer(config), 1, ctypes.pointer(count)) \
+                or count.value == 0:
+            raise RuntimeError("No EGL config supports desktop OpenGL")
+        EGL.eglBindAPI(EGL.EGL_OPENGL_API)
+        context_attributes = (EGL.EGLint * 7)(EGL.EGL_CONTEXT_MAJOR_VERSION, 4, EGL.EGL_CONTEXT_MINOR_VERSION, 3,
+                                              EGL.EGL_CONTEXT_OPENGL_PROFILE_MASK,
+                                              EGL.EGL_CONTEXT_OPENGL_CORE_PROFILE_BIT, EGL.EGL_NONE)
+        self.context = EGL.eglCreateContext(self.display, config, EGL.EGL_NO_CONTEXT, context_attributes)
+        if not self.context:
+            raise RuntimeError("Couldn't create an OpenGL 4.3 context")
+        if not EGL.eglMakeCurrent(self.display, EGL.EGL_NO_SURFACE, EGL.EGL_NO_SURFACE, self.context):
+            raise RuntimeError("Couldn't make the context current (is EGL_KHR_surfaceless_context missing?)")
+
+    def _create_osmesa(self):
+        from OpenGL import GL, arrays, osmesa
+
+        attributes = arrays.GLintArray.asArray([
+            osmesa.OSMESA_FORMAT, osmesa.OSMESA_RGBA, osmesa.OSMESA_DEPTH_BITS, 24,
+            osmesa.OSMESA_PROFILE, osmesa.OSMESA_CORE_PROFILE,
+            osmesa.OSMESA_CONTEXT_MAJOR_VERSION, 4, osmesa.OSMESA_CONTEXT_MINOR_VERSION, 3, 0
+        ])
+        self.context = osmesa.OSMesaCreateContextAttribs(attributes, None)
+        if not self.context:
+            raise RuntimeError("Couldn't create an OpenGL 4.3 OSMesa context")
+        self.buffer = arrays.GLubyteArray.zeros((1, 1, 4))  # has to stay alive as long as the context
+        if not osmesa.OSMesaMakeCurrent(self.context, self.buffer, GL.GL_UNSIGNED_BYTE, 1, 1):
+            raise RuntimeError("Couldn't make the context current")
+
+
+def find_models(workspace, patterns):
+    """
+    Find model files matching some globs.
+
+    Patterns can either be resource locations, like ``minecraft:block/*`` (the same as
+    ``assets/minecraft/models/block/*.json``), or globs on real paths.
+
+    :return: sorted list of (name, real path), name being the resource location form
+    """
+    globs = []
+    for pattern in patterns:
+        if ":" in pattern:
+            domain, path = pattern.split(":", 1)
+            pattern = "assets/{}/models/{}.json".format(domain, path)
+        globs.append(os.path.normpath(pattern))
+
+    found = []
+    for path in set(workspace.list_files()):  # overridden files are listed once per source
+        if any(fnmatch.fnmatchcase(path, x) for x in globs):
+            parts = path.split(os.path.sep)
+            if len(parts) > 3 and parts[0] == "assets" and parts[2] == "models":
+                name = "{}:{}".format(parts[1], "/".join(parts[3:])[:-len(".json")])
+            else:
+                name = path
+            found.append((name, path))
+    return sorted(found)
+
+
+def _load_model(workspace, path):
+    from mcjsontool.render.model import BlockModel
+
+    try:
+        return BlockModel.load_from_file(workspace, path)
+    except (OSError, KeyError, json.JSONDecodeError, ValueError):  # OSError covers files PIL can't read
+        return None
+
+
+def _new_sheet(count, size):
+    """
+    :return: empty sheet with room for count icons, and how many columns it has
+    """
+    import numpy as np
+
+    columns = max(1, math.ceil(math.sqrt(count)))
+    return np.zeros((max(1, math.ceil(count / columns)) * size, columns * size, 4), dtype=np.uint8), columns
+
+
+def _crop_sheet(sheet, index, columns, size):
+    return sheet[:max(1, math.ceil(len(index) / columns)) * size]
+
+
+def render_sheet(workspace, models, size=128, threads=None, processes=None):
+    """
+    Render models into a sprite sheet, using the current context.
+
+    Models are loaded on a pool of threads (or compiled on a :py:class:`ModelLoaderPool` if processes is given) while
+    earlier ones are drawing, and drawn in batches into one framebuffer (so it's read back once per batch,
+    asynchronously).
+
+    :param workspace: workspace to load from
+    :param models: list of (name, real path), see find_models
+    :param size: icon size in pixels
+    :param threads: how many threads load models, defaults to the workspace's scan_threads
+    :param processes: load and compile models on this many processes instead
+    :return: (sheet, index, failed). sheet is a (height, width, 4) uint8 array (top row first), index is a dict of
+             name -> (x, y) of its icon, and failed is a list of names that couldn't be rendered
+    """
+    import OpenGL.GL as GL
+    from mcjsontool.render.glrender import AsyncReadback, ModelRenderer, create_framebuffer
+    from mcjsontool.render.loader import ModelLoaderPool
+
+    sheet, columns = _new_sheet(len(models), size)
+    index = {}
+    failed = []
+
+    tiles = max(1, BATCH_PIXELS // size)
+    fbo, tex, rbuf = create_framebuffer(tiles * size, tiles * size)
+    readback = AsyncReadback(tiles * size * tiles * size * 4)
+    renderer = ModelRenderer(workspace)
+
+    def paste(drawn, pixels):
+        for tile, slot in drawn:
+            x, y = (tile % tiles) * size, (tile // tiles) * size
+            sheet_x, sheet_y = (slot % columns) * size, (slot // columns) * size
+            sheet[sheet_y:sheet_y + size, sheet_x:sheet_x + size] = pixels[y:y + size, x:x + size][::-1]
+
+    if processes:
+        pool = ModelLoaderPool(workspace, processes)
+        loading = (model for _, model in pool.load([path for _, path in models]))
+    else:
+        pool = concurrent.futures.ThreadPoolExecutor(threads or workspace.scan_threads)
+        loading = (x.result() for x in [pool.submit(_load_model, workspace, path) for _, path in models])
+
+    with pool:
+
+        GL.glBindFramebuffer(GL.GL_FRAMEBUFFER, fbo)
+        GL.glClearColor(0, 0, 0, 0)
+        for start in range(0, len(models), tiles * tiles):
+            GL.glViewport(0, 0, tiles * size, tiles * size)
+            GL.glClear(GL.GL_DEPTH_BUFFER_BIT | GL.GL_COLOR_BUFFER_BIT)
+            drawn = []
+            for tile, i in enumerate(range(start, min(start + tiles * tiles, len(models)))):
+                name = models[i][0]
+                model = next(loading)
+                GL.glViewport((tile % tiles) * size, (tile // tiles) * size, size, size)
+                try:
+                    if model is None:
+                        raise ValueError()
+                    renderer.draw_model_icon(model)
+                except (OSError, KeyError, json.JSONDecodeError, ValueError):
+                    failed.append(name)
+                    continue
+                slot = len(index)
+                index[name] = ((slot % columns) * size, (slot // columns) * size)
+                drawn.append((tile, slot))
+
+            rows = -(-(min(len(models), start + tiles * tiles) - start) // tiles)
+            readback.read(0, 0, tiles * size, rows * size, lambda pixels, drawn=drawn: paste(drawn, pixels))
+            readback.poll()
+
+        readback.flush()
+        GL.glBindFramebuffer(GL.GL_FRAMEBUFFER, 0)
+
+    GL.glDeleteFramebuffers(1, [fbo])
+    GL.glDeleteTextures([tex])
+    GL.glDeleteRenderbuffers(1, [rbuf])
+
+    return _crop_sheet(sheet, index, columns, size), index, failed
+
+
+def render_sheet_software(workspace, models, size=128, threads=None):
+    """
+    Like render_sheet, but draws with the software renderer (see :py:mod:`mcjsontool.render.softrender`), so it
+    doesn't need OpenGL at all. Models are loaded and drawn on a pool of threads.
+    """
+    from mcjsontool.render.softrender import SoftwareRenderer
+
+    sheet, columns = _new_sheet(len(models), size)
+    index = {}
+    failed = []
+    renderer = SoftwareRenderer(workspace)
+
+    def draw(path):
+        model = _load_model(workspace, path)
+        if model is None:
+            return None
+        try:
+            return renderer.render_icon(model, size)
+        except (OSError, KeyError, json.JSONDecodeError, ValueError):
+            return None
+
+    with concurrent.futures.ThreadPoolExecutor(threads or workspace.scan_threads) as pool:
+        for (name, _), icon in zip(models, pool.map(draw, [path for _, path in models])):
+            if icon is None:
+                failed.append(name)
+                continue
+            slot = len(index)
+            index[name] = x, y = (slot % columns) * size, (slot // columns) * size
+            sheet[y:y + size, x:x + size] = icon
+
+    return _crop_sheet(sheet, index, columns, size), index, failed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Render model icons into a sprite sheet, without a window")
+    parser.add_argument("workspace", help="workspace file (.mcjtwp)")
+    parser.add_argument("patterns", nargs="+", help="models to render, like minecraft:block/* or a glob on paths")
+    parser.add_argument("-o", "--output", default="icons.png", help="sprite sheet to write")
+    parser.add_argument("--index", help="JSON index to write, defaults to the output with .json")
+    parser.add_argument("--size", type=int, default=128, help="icon size in pixels")
+    parser.add_argument("--threads", type=int, help="threads loading models")
+    parser.add_argument("--processes", type=int, help="load and compile models on this many processes instead")
+    parser.add_argument("--backend", choices=("egl", "osmesa", "software"), default="egl",
+                        help="how to get a context, software renders on the cpu without OpenGL")
+    args = parser.parse_args(argv)
+
+    if args.backend != "software":
+        os.environ["PYOPENGL_PLATFORM"] = args.backend
+
+    from PIL import Image
+    from mcjsontool.resource.workspace import Workspace
+
+    workspace = Workspace.load_from_file(args.workspace)
+    workspace.refresh_file_cache(changed_only=True)
+    models = find_models(workspace, args.patterns)
+    if not models:
+        print("No models match", file=sys.stderr)
+        return 1
+
+    if args.backend != "software":
+        HeadlessContext(args.backend)
+    start = time.perf_counter()
+    if args.backend == "software":
+        sheet, index, failed = render_sheet_software(workspace, models, args.size, args.threads)
+    else:
+        sheet, index, failed = render_sheet(workspace, models, args.size, args.threads, args.processes)
+    taken = time.perf_counter() - start
+
+    Image.fromarray(sheet, "RGBA").save(args.output)
+    height, width = sheet.shape[:2]
+    index_path = args.index or os.path.splitext(args.output)[0] + ".json"
+    with open(index_path, "w") as f:
+        json.dump({
+            "image": os.path.basename(args.output),
+            "width": width,
+            "height": height,
+            "icon_size": args.size,
+            "icons": {name: {"x": x, "y": y, "w": args.size, "h": args.size,
+                             "uv": [x / width, y / height, (x + args.size) / width, (y + args.size) / height]}
+                      for name, (x, y) in index.items()},
+            "failed": failed
+        }, f, indent=1)
+
+    print("Rendered {} models in {:.2f}s ({:.1f} models/sec), {} failed".format(
+        len(index), taken, len(index) / taken if taken else 0, len(failed)))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
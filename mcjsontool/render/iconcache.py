@@ -0,0 +1,155 @@
+import hashlib
+import os
+import pathlib
+import threading
+
+from PyQt5.QtGui import QImage
+
+from mcjsontool.resource.cache import LRUCache
+
+ICON_CACHE_BYTES = 64 * 1024 * 1024
+ICON_CACHE_VERSION = 4  # bump if the renderer changes how icons look
+DIGEST_CACHE_SIZE = 8192
+
+
+class IconCache:
+    """
+    Persistent cache of rendered model icons, stored as PNGs under ~/.mcjsontool/icons.
+
+    Icons are content addressed: the key is a hash of the bytes of every file the model was resolved from (its json
+    and all of its parents'), the textures it draws with, the display transform and the render size. So an icon is
+    reused across launches and workspaces as long as what it was drawn from is the same, and anything that changed
+    just misses and gets rendered again.
+
+    The folder is kept under max_bytes by deleting the least recently used icons (hits touch the file's mtime).
+    """
+
+    def __init__(self, folder=None, max_bytes=ICON_CACHE_BYTES):
+        """
+        :param folder: where to store icons, defaults to ~/.mcjsontool/icons
+        :param max_bytes: size cap for the folder
+        """
+        self.folder = pathlib.Path(folder or "~/.mcjsontool/icons").expanduser()
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._size = None  # worked out on the first put
+        self._lock = threading.Lock()
+        self._digests = LRUCache(DIGEST_CACHE_SIZE)  # file fingerprint -> digest of its contents
+
+    def _file_digest(self, workspace, path):
+        """
+        Hash a file's contents, remembering the result for as long as the file's fingerprint stays the same
+        """
+        fingerprint = workspace.file_fingerprint(path)
+        if fingerprint is None:
+            return b""
+        digest = self._digests.get((path, fingerprint))
+        if digest is None:
+            with workspace.get_file(path, "rb") as f:
+                digest = hashlib.sha1(f.read()).digest()
+            self._digests.put((path, fingerprint), digest)
+        return digest
+
+    def key_for(self, workspace, model, transform="gui", size=128):
+        """
+        Work out the key of a model's icon
+
+        :param workspace: workspace the model was loaded from
+        :param model: the blockmodel, must have been loaded from a file
+        :param transform: display transform the icon is drawn with
+        :param size: icon size in pixels
+        :return: hex digest
+        """
+        if not model.source_chain:
+            raise ValueError("Only models loaded from files can be cached")
+        h = hashlib.sha1()
+        h.update("{}:{}:{}:{}".format(ICON_CACHE_VERSION, transform, size, model.variant).encode())
+        for path, _ in model.source_chain:
+            h.update(self._file_digest(workspace, path))
+        for name, location in sorted(model.get_used_textures().items()):
+            realpath = location.get_real_path()
+            h.update(name.encode())
+            h.update(self._file_digest(workspace, realpath))
+            h.update(self._file_digest(workspace, realpath + ".mcmeta"))
+        return h.hexdigest()
+
+    def _path_for(self, key):
+        return self.folder / key[:2] / (key + ".png")
+
+    def get(self, key):
+        """
+        Get a cached icon
+
+        :param key: key from key_for
+        :return: QImage or None
+        """
+        path = self._path_for(key)
+        image = QImage(str(path)) if path.exists() else QImage()
+        if image.isNull():
+            self.misses += 1
+            return None
+        self.hits += 1
+        try:
+            os.utime(str(path))
+        except OSError:
+            pass
+        return image
+
+    def put(self, key, image: QImage):
+        """
+        Store an icon, evicting old ones if the folder is over the size cap
+        """
+        path = self._path_for(key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        temp_path = path.with_suffix(".tmp")
+        if not image.save(str(temp_path), "PNG"):
+            return
+        with self._lock:
+            try:
+                old_size = path.stat().st_size  # overwriting an icon only adds the difference
+            except OSError:
+                old_size = 0
+            os.replace(str(temp_path), str(path))
+            if self._size is None:
+                self._size = sum(x.stat().st_size for x in self.folder.glob("*/*.png"))
+            else:
+                self._size += path.stat().st_size - old_size
+            if self._size > self.max_bytes:
+                self._evict()
+
+    def _evict(self):
+        """
+        Delete least recently used icons until the folder is back under 90% of the cap (so this doesn't run on
+        every put once it's full)
+        """
+        entries = []
+        for icon in self.folder.glob("*/*.png"):
+            try:
+                stat = icon.stat()
+            except OSError:
+                continue
+            entries.append((stat.st_mtime_ns, stat.st_size, icon))
+        entries.sort()
+        self._size = sum(x[1] for x in entries)
+        target = self.max_bytes * 0.9
+        for _, size, icon in entries:
+            if self._size <= target:
+                break
+            try:
+                icon.unlink()
+            except OSError:
+                continue
+            self._size -= size
+
+    def clear(self):
+        with self._lock:
+            for icon in self.folder.glob("*/*.png"):
+                icon.unlink()
+            self._size = 0
+
+    def stats(self):
+        """
+        :return: dictionary of hits, misses and size on disk (None until the first put)
+        """
+        return {"hits": self.hits, "misses": self.misses, "size": self._size}
@@ -0,0 +1,138 @@
+import concurrent.futures
+import json
+import multiprocessing
+import os
+
+import numpy as np
+
+from mcjsontool.render.model import BlockModel
+from mcjsontool.render.texture import WorkspaceAtlas
+from mcjsontool.resource.workspace import Workspace
+
+BATCH_SIZE = 32  # models sent to a worker at once
+
+_workspace: Workspace = None  # the worker's copy
+_atlas: WorkspaceAtlas = None  # scratch atlas the worker packs each model's textures into
+
+
+class CompiledModel:
+    """
+    A model loaded and compiled by a :py:class:`ModelLoaderPool` worker: everything needed to draw it, and nothing
+    else, so it's cheap to send between processes.
+
+    Has the same cache_key and transforms as the BlockModel it came from, so renderers can use it in place of one
+    (see ModelRenderer.setup_data_for_compiled).
+    """
+
+    def __init__(self, model: BlockModel, workspace: Workspace, atlas: WorkspaceAtlas = None):
+        """
+        Compile a model against its own atlas.
+
+        The textures are packed by a :py:class:`WorkspaceAtlas` (which copes with any mix of sizes), cropped down to
+        what's used, and the uvs normalized to the crop.
+
+        :param model: the model
+        :param workspace: workspace to load textures from
+        :param atlas: scratch atlas to pack with, cleared first. Pass the same one for every model to save allocating
+                      a whole atlas each time; a new one is made if not given.
+        """
+        if atlas is None:
+            atlas = WorkspaceAtlas()
+        else:
+            atlas.clear()
+        view = atlas.add_model(model, workspace)
+        width = max(x + w for x, y, w, h in view.rects.values())
+        height = max(y + h for x, y, w, h in view.rects.values())
+
+        self.location = model.location
+        self.cache_key = model.cache_key
+        self.texture_state = model.texture_fingerprints(workspace)
+        self.transforms = model.transforms
+        self.vertices, self.indices = model.compile_to_indexed(view)
+        self.vertices[:, 4:6] /= (width, height)
+        self.vertices[:, 8] /= height
+        self.pixels = atlas.data[:height, :width].copy()  # never a view, the atlas gets reused
+
+    @property
+    def nbytes(self):
+        return self.vertices.nbytes + self.indices.nbytes + self.pixels.nbytes
+
+
+def _init_worker(workspace, save_path):
+    global _workspace, _atlas
+    _workspace = workspace
+    _atlas = WorkspaceAtlas()
+    if save_path is not None:
+        # start from the saved file index instead of looking for every file
+        _workspace.save_path = save_path
+        _workspace._load_file_index()
+
+
+def _compile_batch(locations):
+    """
+    Load and compile some models in a worker
+
+    :return: list of CompiledModel, or None for models that couldn't be loaded
+    """
+    results = []
+    for location in locations:
+        try:
+            results.append(CompiledModel(BlockModel.load_from_file(_workspace, location), _workspace, _atlas))
+        except (OSError, KeyError, json.JSONDecodeError, ValueError):
+            results.append(None)
+    return results
+
+
+class ModelLoaderPool:
+    """
+    Loads and compiles models on a pool of processes, so it isn't all stuck behind the GIL.
+
+    Every worker gets its own copy of the workspace (and its own model and texture caches, so parents and textures
+    shared by models in the same batch are only loaded once). What comes back are :py:class:`CompiledModel`
+    instances, which are just numpy arrays; upload them on the GL thread.
+
+    Workers are spawned rather than forked, since forking a process that has GL contexts and Qt threads in it isn't
+    safe. That makes starting the pool cost a bit, so keep one around.
+    """
+
+    def __init__(self, workspace: Workspace, processes=None):
+        """
+        :param workspace: the workspace to load from
+        :param processes: how many worker processes, defaults to the number of cores
+        """
+        self.executor = concurrent.futures.ProcessPoolExecutor(processes or os.cpu_count(),
+                                                               mp_context=multiprocessing.get_context("spawn"),
+                                                               initializer=_init_worker,
+                                                               initargs=(workspace, workspace.save_path))
+
+    def submit(self, locations):
+        """
+        Start loading some models
+
+        :param locations: locations/paths of models
+        :return: list of futures, each giving a list of CompiledModel (or None) for BATCH_SIZE of the locations
+        """
+        locations = list(locations)
+        return [self.executor.submit(_compile_batch, locations[i:i + BATCH_SIZE])
+                for i in range(0, len(locations), BATCH_SIZE)]
+
+    def load(self, locations):
+        """
+        Load and compile models, yielding them in order as they're ready
+
+        :param locations: locations/paths of models
+        :return: iterator of (location, CompiledModel or None if it couldn't be loaded)
+        """
+        locations = list(locations)
+        futures = self.submit(locations)
+        for i, future in enumerate(futures):
+            yield from zip(locations[i * BATCH_SIZE:(i + 1) * BATCH_SIZE], future.result())
+
+    def close(self):
+        self.executor.shutdown(wait=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
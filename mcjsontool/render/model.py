@@ -1,11 +1,15 @@
 import json
+import os
 import glm
 import math
+import numpy as np
 from typing import List, Tuple
 
 from mcjsontool.render.texture import ModelAtlas, Texture
 from ..resource.workspace import Workspace, DomainResourceLocation, ResourceLocation
 
+VERTEX_FLOATS = 9  # x, y, z, w, u, v, frames, frametime, frame distance
+
 
 class Cube:
     """
@@ -18,7 +22,8 @@ class Cube:
         - south = +z
         - up = +y
 
-    Faces dictionary refers to (texture_name, uv1, uv2, rot)
+    Faces dictionary refers to (texture_name, uv1, uv2, rot, cullface). cullface is the side of the block (a face
+    name) whose neighbour hides the face when it's opaque, or None.
 
     TODO: add rotation support
     """
@@ -40,6 +45,13 @@ class Cube:
         "north": (glm.vec3(0, 0, 0), glm.vec3(0, 1, 0), glm.vec3(1, 0, 0), [1, 0])
     }
 
+    FACE_NAMES = ["down", "up", "north", "south", "west", "east"]  # index is the bit for the side in cull masks
+    NORMALS = [(0, -1, 0), (0, 1, 0), (0, 0, -1), (0, 0, 1), (-1, 0, 0), (1, 0, 0)]
+    OPPOSITE = [1, 0, 3, 2, 5, 4]
+    # corners of the uv rectangle (u1, v1, u2, v2) each vertex starts with, before rotation
+    UV_CORNERS = [[0, 3], [0, 1], [2, 1], [2, 3]]
+    TRIANGLE_ORDER = [0, 1, 2, 0, 3, 2]
+
     def __init__(self, start, end):
         self.start = glm.vec3(*start)
         self.end = glm.vec3(*end)
@@ -61,6 +73,23 @@ class Cube:
         self.matrix = glm.rotate(self.matrix, math.radians(angle), Cube.AXES[axis])
         self.matrix = glm.translate(self.matrix, -glm.vec3(*origin))
 
+    def copy(self, matrix=None, texture_prefix="", cullfaces=None):
+        """
+        Make a copy of this cube
+
+        :param matrix: transform the copy by this too (applied after the cube's own rotation)
+        :param texture_prefix: put this before the texture variable of every face
+        :param cullfaces: dict to rename cullfaces with (for when matrix turns the cube)
+        :rtype: Cube
+        """
+        cube = Cube(self.start, self.end)
+        cube.matrix = self.matrix if matrix is None else matrix * self.matrix
+        for k, (texture, uv1, uv2, rot, cullface) in self.faces.items():
+            if cullfaces is not None and cullface is not None:
+                cullface = cullfaces[cullface]
+            cube.faces[k] = (texture_prefix + texture, uv1, uv2, rot, cullface)
+        return cube
+
     def remove_face(self, face):
         """
         Remove this face from rendering
@@ -69,7 +98,7 @@ class Cube:
         """
         del self.faces[face]
 
-    def set_face(self, face, texture, rot, uv1=None, uv2=None):
+    def set_face(self, face, texture, rot, uv1=None, uv2=None, cullface=None):
         """
         Add a face to this cube
 
@@ -78,6 +107,7 @@ class Cube:
         :param rot: rotation amount (div by 90)
         :param uv1: x1, y1
         :param uv2: x2, y2
+        :param cullface: side of the block that hides this face when it has an opaque neighbour, or None
 
         """
 
@@ -92,7 +122,7 @@ class Cube:
                 max(0, min(16, self.end[int(abs(dat[3][1]))])),
             ]
 
-        self.faces[face] = (texture, uv1, uv2, rot)
+        self.faces[face] = (texture, uv1, uv2, rot, cullface)
 
     def _permute(self, i, rot):
         return (i + rot) % 4
@@ -117,7 +147,7 @@ class Cube:
         uvs = []
         for face in self.faces:
             dat = Cube.FACES[face]
-            texture, uv1, uv2, rot = self.faces[face]
+            texture, uv1, uv2, rot, _ = self.faces[face]
             v1 = self.start + (self.off * dat[0])
             v2 = v1 + (self.off * dat[1])
             v3 = v2 + (self.off * dat[2])
@@ -143,6 +173,13 @@ class Cube:
         return self._transform_vertex_list(vertices), uvs
 
 
+# FACE_CORNERS[i] holds the 4 corners of face FACE_NAMES[i], as fractions of the cube's size
+# (the same v1, v2, v3, v4 that compile_to_vertex_list works out)
+Cube.FACE_CORNERS = np.array([[tuple(x) for x in (dat[0], dat[0] + dat[1], dat[0] + dat[1] + dat[2], dat[0] + dat[2])]
+                              for dat in (Cube.FACES[x] for x in Cube.FACE_NAMES)], dtype=np.float32)
+Cube.FACE_INDEX = {x: i for i, x in enumerate(Cube.FACE_NAMES)}
+
+
 class BlockModel:
     """
     A BlockModel holds a full definition for a block. BlockModels can also
@@ -165,16 +202,45 @@ class BlockModel:
         self.cubes = None
         self.textures = {}
         self.transforms = {}
+        self.location = None
+        self.variant = None  # set when a blockstate variant is applied
+        self.source_chain = []  # (path, fingerprint) of this model's file and all of its parents
+
+    def copy(self):
+        """
+        Make a copy of this model that can be modified without changing this one (cubes are shared)
 
-    def create_model_atlas(self, workspace) -> ModelAtlas:
+        :rtype: BlockModel
+        """
+        model = BlockModel()
+        model.cubes = None if self.cubes is None else self.cubes.copy()
+        model.textures = self.textures.copy()
+        model.transforms = self.transforms.copy()
+        model.location = self.location
+        model.variant = self.variant
+        model.source_chain = self.source_chain
+        return model
+
+    @property
+    def cache_key(self):
+        """
+        Identifies this model's geometry for caching things built from it: its location, variant and the
+        fingerprints of its files. None for models that weren't loaded from a file.
+        """
+        if self.location is None:
+            return None
+        return self.location, self.variant, tuple(self.source_chain)
+
+    def create_model_atlas(self, workspace, mip_levels=0) -> ModelAtlas:
         """
         Create a model atlas from this model's textures (configure with a state to get its textures)
 
         :param workspace: workspace to load textures from
+        :param mip_levels: mipmap levels to pad the atlas for (see :py:class:`ModelAtlas`)
         :return: a model atlas
         """
         self._update_textures()
-        return ModelAtlas(self._get_loaded_textures(workspace))
+        return ModelAtlas(self._get_loaded_textures(workspace), mip_levels)
 
     def compile_to_vertex_list(self, atlas):
         """
@@ -190,12 +256,92 @@ class BlockModel:
             uvs.extend(nu)
         return verts, uvs
 
-    def _get_loaded_textures(self, workspace):
+    def compile_to_array(self, atlas, hidden=0):
         """
-        Get a dictionary of all textures in Texture format
-        :param workspace: workspace to load from
-        :return: dict of textures
+        Create an interleaved vertex array for this model, like compile_to_vertex_list but built with numpy for all
+        faces at once (so it's much faster for big models).
+
+        Each vertex is VERTEX_FLOATS floats: x, y, z, w, u, v, then the animation of its texture as frames, frametime
+        and the distance between frames in atlas uvs (the shader adds that times the current frame to v).
+
+        :param atlas: An atlas to use (needs uv_transform and animation)
+        :param hidden: sides of the block with an opaque neighbour, as a mask (bit i is Cube.FACE_NAMES[i]). Faces
+                       that cull against them are left out.
+        :return: float32 array of shape (n, VERTEX_FLOATS). Every 3 rows are a triangle.
+        """
+        quads = self._compile_quads(atlas, hidden)
+        return np.ascontiguousarray(quads[:, Cube.TRIANGLE_ORDER].reshape(-1, VERTEX_FLOATS))
+
+    def compile_to_indexed(self, atlas, hidden=0):
+        """
+        Create an indexed mesh for this model: 4 vertices per face instead of 6, with identical vertices (like the
+        shared corners of neighbouring faces with the same uvs) merged.
+
+        :param atlas: An atlas to use (needs uv_transform and animation)
+        :param hidden: see compile_to_array
+        :return: vertices, indices. vertices is a float32 array like compile_to_array's, indices is a uint16 array
+                 (uint32 for huge models) where every 3 are a triangle
+        """
+        quads = self._compile_quads(atlas, hidden)
+        indices = (np.arange(len(quads))[:, None] * 4 + Cube.TRIANGLE_ORDER).ravel()
+        vertices, inverse = np.unique(quads.reshape(-1, VERTEX_FLOATS), axis=0, return_inverse=True)
+        index_type = np.uint16 if len(vertices) <= 0xFFFF else np.uint32
+        return np.ascontiguousarray(vertices), inverse.ravel()[indices].astype(index_type)
+
+    def _compile_quads(self, atlas, hidden=0):
         """
+        Compile every face of this model (that isn't hidden)
+
+        :param atlas: An atlas to use (needs uv_transform and animation)
+        :param hidden: see compile_to_array
+        :return: float32 array of shape (faces, 4, VERTEX_FLOATS), the 4 corners of each face (see compile_to_array)
+        """
+        starts, offs, faces, uvs, rots, uv_transforms, cube_of_face = [], [], [], [], [], [], []
+        animations = []
+        matrices = []
+        for n, cube in enumerate(self.cubes or ()):
+            matrices.append([tuple(cube.matrix[i]) for i in range(4)])  # columns
+            for face, (texture, uv1, uv2, rot, cullface) in cube.faces.items():
+                if cullface is not None and hidden >> Cube.FACE_INDEX[cullface] & 1:
+                    continue
+                starts.append(tuple(cube.start))
+                offs.append(tuple(cube.off))
+                faces.append(Cube.FACE_INDEX[face])
+                uvs.append((uv1[0], uv1[1], uv2[0], uv2[1]))
+                rots.append(rot)
+                uv_transforms.append(atlas.uv_transform(texture))
+                animations.append(atlas.animation(texture))
+                cube_of_face.append(n)
+        if not faces:
+            return np.zeros((0, 4, VERTEX_FLOATS), dtype=np.float32)
+
+        # positions: corners of every face, then through each cube's matrix.
+        # matrices are stored as columns, so row vector @ columns is the same as matrix * column vector
+        corners = np.array(starts, dtype=np.float32)[:, None, :] + \
+            np.array(offs, dtype=np.float32)[:, None, :] * Cube.FACE_CORNERS[faces]
+        positions = np.concatenate([corners, np.ones(corners.shape[:2] + (1,), dtype=np.float32)], axis=2)
+        positions = np.matmul(positions, np.array(matrices, dtype=np.float32)[cube_of_face])
+
+        # uvs: pick the corner of the uv rectangle for each vertex, rotate, then map into the atlas
+        corner_uvs = np.array(uvs, dtype=np.float32)[:, Cube.UV_CORNERS]
+        order = (np.arange(4)[None, :] + np.array(rots)[:, None]) % 4
+        corner_uvs = np.take_along_axis(corner_uvs, order[:, :, None], axis=1)
+        uv_transforms = np.array(uv_transforms, dtype=np.float32)[:, None, :]
+        corner_uvs = uv_transforms[..., :2] + corner_uvs * uv_transforms[..., 2:]
+
+        # animation: frames are a texture width (16 units) apart
+        animation = np.concatenate([np.array(animations, dtype=np.float32), 16 * uv_transforms[:, 0, 3:]], axis=1)
+        animation = np.broadcast_to(animation[:, None, :], (len(faces), 4, 3))
+
+        return np.concatenate([positions, corner_uvs, animation], axis=2).astype(np.float32, copy=False)
+
+    def get_used_textures(self):
+        """
+        Get the textures this model actually draws with
+
+        :return: dict of texture names to ResourceLocations
+        """
+        self._update_textures()
         if self.cubes is None:
             usable = list(self.textures.keys())
         else:
@@ -205,18 +351,89 @@ class BlockModel:
                     usable.append(cube.faces[face][0])
             usable = list(set(usable))
         filtered_textures = {k: v for k, v in self.textures.items() if isinstance(v, ResourceLocation) and k in usable}
-        if len(filtered_textures) is 0:
+        if not filtered_textures:
             raise ValueError("fail')")
-        return {k: Texture.load_from_file(workspace, v, True) for k, v in filtered_textures.items()}
+        return filtered_textures
+
+    def cullfaces(self):
+        """
+        :return: the cullface of every face (in the order they're compiled in), as indices into Cube.FACE_NAMES or -1
+        """
+        return [-1 if x[4] is None else Cube.FACE_INDEX[x[4]] for cube in self.cubes or () for x in cube.faces.values()]
+
+    def occluding_sides(self, workspace):
+        """
+        Work out which sides of the block this model covers completely with opaque faces, so it hides the faces of
+        its neighbours that cull against it.
+
+        :param workspace: workspace to load textures from (to see if they're opaque)
+        :return: mask, bit i is Cube.FACE_NAMES[i]
+        """
+        mask = 0
+        textures = self.get_used_textures()
+        opaque = {k: np.frombuffer(Texture.load_from_file(workspace, v, True).data, dtype=np.uint8)[3::4].min() == 255
+                  for k, v in textures.items()}
+        full_side = {(0, 0), (0, 16), (16, 0), (16, 16)}
+        for cube in self.cubes or ():
+            columns = np.array([tuple(cube.matrix[i]) for i in range(4)], dtype=np.float32)
+            for face, (texture, uv1, uv2, rot, cullface) in cube.faces.items():
+                if not opaque.get(texture, False):
+                    continue
+                corners = np.array(tuple(cube.start), dtype=np.float32) + \
+                    np.array(tuple(cube.off), dtype=np.float32) * Cube.FACE_CORNERS[Cube.FACE_INDEX[face]]
+                corners = (np.concatenate([corners, np.ones((4, 1), dtype=np.float32)], axis=1) @ columns)[:, :3]
+                for side, normal in enumerate(Cube.NORMALS):
+                    axis = int(np.flatnonzero(normal)[0])
+                    if not np.allclose(corners[:, axis], 16 if normal[axis] > 0 else 0, atol=1e-4):
+                        continue
+                    # on that side of the block, see if it's the whole thing
+                    if set(map(tuple, np.delete(corners, axis, axis=1).round(3).tolist())) == full_side:
+                        mask |= 1 << side
+        return mask
+
+    def texture_fingerprints(self, workspace):
+        """
+        Get the fingerprints of the texture files this model draws with, for telling if a compiled copy of it is
+        still good.
+
+        :param workspace: workspace the textures are in
+        :return: sorted tuple of (texture name, fingerprint)
+        """
+        return tuple(sorted((k, workspace.file_fingerprint(v), workspace.file_fingerprint(v.get_real_path() + ".mcmeta"))
+                            for k, v in self.get_used_textures().items()))
+
+    def _get_loaded_textures(self, workspace):
+        """
+        Get a dictionary of all textures in Texture format
+        :param workspace: workspace to load from
+        :return: dict of textures
+        """
+        return {k: Texture.load_from_file(workspace, v, True) for k, v in self.get_used_textures().items()}
 
     def apply_state(self, state):
         """
-        Apply a ModelState
+        Apply a blockstate variant (see :py:class:`mcjsontool.render.blockstate.Variant`), which rotates the whole
+        model around its center: x first, then y. Cullfaces turn with it.
+
+        fixme: uvlock is remembered in variant but not applied, faces keep their uvs when rotated
+
         :param state: to apply
         :return: a new model with this state
         :rtype: BlockModel
         """
-        pass
+        model = self.copy()
+        model.variant = state.rotation
+        if (state.x or state.y) and model.cubes is not None:
+            matrix = glm.translate(glm.mat4(1), glm.vec3(8, 8, 8))
+            matrix = glm.rotate(matrix, -math.radians(state.y), glm.vec3(0, 1, 0))
+            matrix = glm.rotate(matrix, -math.radians(state.x), glm.vec3(1, 0, 0))
+            matrix = glm.translate(matrix, glm.vec3(-8, -8, -8))
+            cullfaces = {}
+            for name, normal in zip(Cube.FACE_NAMES, Cube.NORMALS):
+                turned = tuple(round(x) for x in glm.vec3(matrix * glm.vec4(*normal, 0)))
+                cullfaces[name] = Cube.FACE_NAMES[Cube.NORMALS.index(turned)]
+            model.cubes = [cube.copy(matrix, cullfaces=cullfaces) for cube in model.cubes]
+        return model
 
     def merge_with_parent(self, parent):
         """
@@ -276,14 +493,52 @@ class BlockModel:
         """
         Load model from a location
 
+        Parsed models are cached on the workspace (along with the fingerprints of their files and their parents'),
+        so each file is only read and parsed once while it stays the same.
+
         :param workspace: workspace to load in
         :param location: location/path to model
-        :return: a loaded model
+        :return: a loaded model (a copy of the cached one, so it's yours to modify)
         :rtype: BlockModel
         """
-        with workspace.get_file(location) as f:
+        return cls._load_cached(workspace, location).copy()
+
+    @classmethod
+    def _load_cached(cls, workspace: Workspace, location):
+        """
+        Load a model through the workspace's model cache.
+
+        .. danger:
+            The returned model is shared with the cache (and every model that has it as a parent), don't modify it!
+
+        :param workspace: workspace to load in
+        :param location: location/path to model
+        :rtype: BlockModel
+        """
+        realpath = os.path.normpath(location if not hasattr(location, "get_real_path") else location.get_real_path())
+        model = workspace.model_cache.get(realpath)
+        if model is not None and all(workspace.file_fingerprint(path) == fingerprint
+                                     for path, fingerprint in model.source_chain):
+            return model
+        model = cls._parse(workspace, realpath)
+        workspace.model_cache.put(realpath, model)
+        return model
+
+    @classmethod
+    def _parse(cls, workspace: Workspace, realpath):
+        """
+        Parse a model file, merging it with its (cached) parents
+
+        :param workspace: workspace to load in
+        :param realpath: normalized path to model
+        :rtype: BlockModel
+        """
+        fingerprint = workspace.file_fingerprint(realpath)
+        with workspace.get_file(realpath) as f:
             json_data = json.load(f)
             model = cls()
+            model.location = realpath
+            model.source_chain = [(realpath, fingerprint)]
             if "textures" in json_data:
                 model.textures = json_data["textures"]
                 model._update_textures()
@@ -300,23 +555,30 @@ class BlockModel:
                         cube.set_rotation(origin, axis, angle, rescale)
                     for face_n, face in element["faces"].items():
                         rot = -int(face.get("rotation", 0) / 90)
+                        cullface = face.get("cullface")
+                        if cullface == "bottom":  # old name for down
+                            cullface = "down"
+                        if cullface not in Cube.FACE_INDEX:
+                            cullface = None  # minecraft ignores ones it doesn't know
                         if "uv" in face:
-                            cube.set_face(face_n, face["texture"][1:], rot, face["uv"][:2], face["uv"][2:])
+                            cube.set_face(face_n, face["texture"][1:], rot, face["uv"][:2], face["uv"][2:], cullface)
                         else:
-                            cube.set_face(face_n, face["texture"][1:], rot)
+                            cube.set_face(face_n, face["texture"][1:], rot, cullface=cullface)
                     model.cubes.append(cube)
             if "display" in json_data:
                 for kind, data in json_data["display"].items():
                     model.transforms[kind] = cls._create_transform_for(data["rotation"], data["scale"],
                                                                        data["translation"])
             model.transforms[None] = glm.mat4(1)
-            realpath = location if not hasattr(location, "get_real_path") else location.get_real_path()
             if "parent" in json_data:
-                parent = BlockModel.load_from_file(workspace, DomainResourceLocation("models", json_data["parent"],
-                                                                                     filetype=".json"))
-                model.merge_with_parent(parent)
+                parent = cls._load_cached(workspace, DomainResourceLocation("models", json_data["parent"],
+                                                                            filetype=".json"))
             elif not realpath.endswith("block.json"):
-                parent = BlockModel.load_from_file(workspace, DomainResourceLocation("models", "block/block",
-                                                                                     filetype=".json"))
+                parent = cls._load_cached(workspace, DomainResourceLocation("models", "block/block",
+                                                                            filetype=".json"))
+            else:
+                parent = None
+            if parent is not None:
                 model.merge_with_parent(parent)
+                model.source_chain = model.source_chain + parent.source_chain
             return model
@@ -0,0 +1,301 @@
+import ctypes
+import hashlib
+
+import glm
+import numpy as np
+import OpenGL.GL as GL
+from PyQt5.QtGui import QSurface
+
+from mcjsontool.render.glrender import ModelRenderer, GPUMesh, compile_program
+from mcjsontool.render.model import BlockModel, Cube
+from mcjsontool.render.texture import AtlasView
+
+INSTANCE_FLOATS = 18  # transform (4 columns), uv offset
+POSITION_BITS = 21  # per axis, when packing grid positions for neighbour lookups
+
+
+class SceneRenderer(ModelRenderer):
+    """
+    Draws lots of blocks at once, like a wall of every variant of a block or a test structure.
+
+    Every distinct mesh is uploaded once, and all of its placements are drawn with one instanced draw call: each
+    instance has its own transform and an offset into the shared atlas. Meshes are compiled with their textures moved
+    to the corner of the atlas, and the offset puts them back. So models that only differ by texture (like every block
+    using cube_all) share a mesh too, and a scene of 10k blocks is a handful of draw calls.
+
+    Blocks placed on the grid hide each other's faces: the sides every block's neighbours cover are looked up all at
+    once with numpy, and every block is drawn with a version of its mesh without the faces whose cullface has an
+    opaque neighbour. In a solid chunk of full blocks only the outside is left.
+
+    Always uses the shared atlas (see :py:class:`WorkspaceAtlas`), so everything draws with one texture bound. When
+    textures already in it change (or move), every placement is worked out again on the next draw.
+    It's a ModelRenderer too, so the single model methods still work alongside it.
+    """
+
+    def __init__(self, workspace, surface: QSurface = None, mipmaps=False, compress=False):
+        """
+        :param workspace: workspace to load from
+        :param surface: the surface being drawn to, or None
+        :param mipmaps: see :py:class:`ModelRenderer`
+        :param compress: see :py:class:`ModelRenderer`
+        """
+        super().__init__(None, surface, True, mipmaps, compress)
+        self.scene_shader = compile_program("scene.vertex.glsl", "block.fragment.glsl")
+        self.instance_buffer = GL.glGenBuffers(1)
+
+        self.meshes = {}  # (geometry key, hidden sides) -> GPUMesh, or None if everything is hidden
+        self.draw_list = []  # (mesh key, first instance, instance count), sorted by texture then key
+        self.dirty = False
+
+        # placements
+        self._placements = []  # (model, position, transform)
+        self._rows = []  # instance rows
+        self._keys = []  # geometry keys
+        self._grid = []  # block position if it's on the grid (so it can hide and be hidden), else None
+        self._occludes = []  # sides of the block it covers, see BlockModel.occluding_sides
+
+        self._geometries = {}  # geometry key -> (model, atlas view it's compiled with)
+        self._model_geometry = {}  # (model cache key, atlas rects) -> geometry key, occluded sides
+        self._atlas_changes = None  # shared_atlas.changes the rows were worked out at
+
+        if workspace is not None:
+            self.set_workspace(workspace)
+
+    def set_workspace(self, workspace):
+        super().set_workspace(workspace)
+        self.clear()
+
+    @property
+    def instance_count(self):
+        return len(self._rows)
+
+    @property
+    def index_count(self):
+        """
+        :return: how many indices (3 per triangle) a frame draws
+        """
+        return sum(self.meshes[key].count * count for key, first, count in self.draw_list)
+
+    def _geometry_for(self, model: BlockModel):
+        """
+        Work out which geometry a model has
+
+        :return: key of its geometry, offset of its textures in the atlas, sides it occludes
+        """
+        view = self.shared_atlas.add_model(model, self.workspace)
+        offset = min(x[0] for x in view.rects.values()), min(x[1] for x in view.rects.values())
+        state = tuple(sorted(view.rects.items())), tuple(sorted(view.animations.items()))
+        model_key = None if model.cache_key is None else (model.cache_key, state)
+        found = self._model_geometry.get(model_key)
+        if found is None:
+            local = AtlasView(view.atlas, {k: (x - offset[0], y - offset[1], w, h)
+                                           for k, (x, y, w, h) in view.rects.items()}, view.animations)
+            vertices, indices = model.compile_to_indexed(local)
+            key = hashlib.sha1(vertices.tobytes() + indices.tobytes() +
+                               np.array(model.cullfaces(), dtype=np.int8).tobytes()).digest()
+            self._geometries.setdefault(key, (model, local))
+            found = key, model.occluding_sides(self.workspace)
+            if model_key is not None:
+                self._model_geometry[model_key] = found
+        return found[0], offset, found[1]
+
+    def _mesh_for(self, key, hidden):
+        """
+        Get the mesh of some geometry with some sides hidden, uploading it if it's new
+        """
+        mesh_key = key, hidden
+        if mesh_key not in self.meshes:
+            model, view = self._geometries[key]
+            vertices, indices = model.compile_to_indexed(view, hidden)
+            self.meshes[mesh_key] = self._upload_mesh(vertices, indices) if len(indices) else None
+        return self.meshes[mesh_key]
+
+    def _upload_mesh(self, vertices, indices):
+        """
+        Upload a mesh, with its vao also reading the per instance attributes from the instance buffer
+        """
+        mesh = GPUMesh(vertices, indices)
+        GL.glBindVertexArray(mesh.vao)
+        GL.glBindBuffer(GL.GL_ARRAY_BUFFER, self.instance_buffer)
+        stride = INSTANCE_FLOATS * 4
+        for column in range(4):
+            GL.glEnableVertexAttribArray(3 + column)
+            GL.glVertexAttribPointer(3 + column, 4, GL.GL_FLOAT, GL.GL_FALSE, stride, ctypes.c_void_p(column * 16))
+            GL.glVertexAttribDivisor(3 + column, 1)
+        GL.glEnableVertexAttribArray(7)
+        GL.glVertexAttribPointer(7, 2, GL.GL_FLOAT, GL.GL_FALSE, stride, ctypes.c_void_p(64))
+        GL.glVertexAttribDivisor(7, 1)
+        GL.glBindVertexArray(0)
+        return mesh
+
+    def add(self, model: BlockModel, position=(0, 0, 0), transform=None):
+        """
+        Place a model in the scene.
+
+        :param model: the blockmodel, with its blockstate variant already applied if it has one
+        :param position: where to put it, in blocks. Models at whole numbers without a transform are on the grid,
+                         and hide faces of their neighbours on the grid.
+        :param transform: extra transform applied to the model before moving it into place (in model units,
+                          a block is 16)
+        """
+        self._placements.append((model, position, transform))
+        self._place(model, position, transform)
+        self.dirty = True
+
+    def _place(self, model, position, transform):
+        """
+        Work out a placement's instance row, and what it occludes
+        """
+        key, offset, occludes = self._geometry_for(model)
+        matrix = glm.translate(glm.mat4(1), glm.vec3(*position) * 16)
+        if transform is not None:
+            matrix = matrix * transform
+        row = [x for i in range(4) for x in matrix[i]]  # columns
+        row.extend(offset)
+        on_grid = transform is None and all(float(x).is_integer() for x in position)
+        self._rows.append(row)
+        self._keys.append(key)
+        self._grid.append(tuple(int(x) for x in position) if on_grid else None)
+        self._occludes.append(occludes)
+
+    def _replace_all(self):
+        """
+        Work out every placement again, for when textures in the atlas changed or moved (which the rows have offsets
+        into, and which can change what a model occludes)
+        """
+        self._atlas_changes = self.shared_atlas.changes  # before, in case loading a texture changes it again
+        for x in (self._rows, self._keys, self._grid, self._occludes):
+            x.clear()
+        self._model_geometry.clear()
+        for placement in self._placements:
+            self._place(*placement)
+        self.dirty = True
+
+    def clear(self):
+        """
+        Remove everything from the scene and free its meshes. Needs the context they were made in to be current.
+        """
+        for mesh in self.meshes.values():
+            if mesh is not None:
+                mesh.delete()
+        self.meshes.clear()
+        self.draw_list = []
+        for x in (self._placements, self._rows, self._keys, self._grid, self._occludes):
+            x.clear()
+        self._geometries.clear()
+        self._model_geometry.clear()
+        self._atlas_changes = self.shared_atlas.changes if self.shared_atlas is not None else None
+        self.dirty = True
+
+    def delete(self):
+        """
+        Free everything the scene uploaded, after which it can't be used. Needs its context to be current.
+        """
+        self.clear()
+        GL.glDeleteBuffers(1, [self.instance_buffer])
+        GL.glDeleteProgram(self.scene_shader)
+
+    def _hidden_sides(self):
+        """
+        Work out which sides of every placement have a neighbour covering them, all at once with numpy.
+
+        Positions are packed into one int each (POSITION_BITS per axis) and sorted, so looking up every placement's
+        neighbour in a direction is one searchsorted, however spread out the scene is.
+
+        :return: int array of masks (bit i is Cube.FACE_NAMES[i]), 0 for placements that aren't on the grid
+        """
+        hidden = np.zeros(len(self._rows), dtype=np.int64)
+        on_grid = np.array([x is not None for x in self._grid], dtype=bool)
+        if not on_grid.any():
+            return hidden
+        positions = np.array([x for x in self._grid if x is not None], dtype=np.int64)
+        positions -= positions.min(axis=0) - 1  # leave room for the neighbours below the lowest block
+        if positions.max() + 1 >= 1 << POSITION_BITS:
+            hidden[on_grid] = self._hidden_sides_slow(positions)
+            return hidden
+
+        keys = self._pack(positions)
+        occupied, inverse = np.unique(keys, return_inverse=True)
+        occludes = np.zeros(len(occupied), dtype=np.uint8)
+        np.bitwise_or.at(occludes, inverse.ravel(), np.array(self._occludes, dtype=np.uint8)[on_grid])
+
+        sides = np.zeros(len(positions), dtype=np.int64)
+        for side, normal in enumerate(Cube.NORMALS):
+            neighbour = keys + self._pack(np.array(normal, dtype=np.int64))
+            found = np.minimum(np.searchsorted(occupied, neighbour), len(occupied) - 1)
+            covering = np.where(occupied[found] == neighbour, occludes[found], 0)
+            sides |= ((covering >> Cube.OPPOSITE[side]) & 1).astype(np.int64) << side
+        hidden[on_grid] = sides
+        return hidden
+
+    @staticmethod
+    def _pack(positions):
+        return (positions[..., 0] << 2 * POSITION_BITS) + (positions[..., 1] << POSITION_BITS) + positions[..., 2]
+
+    def _hidden_sides_slow(self, positions):
+        """
+        Same as _hidden_sides with a dict, for scenes too spread out to pack
+        """
+        occludes = {}
+        masks = (mask for mask, position in zip(self._occludes, self._grid) if position is not None)
+        for position, mask in zip(map(tuple, positions.tolist()), masks):
+            occludes[position] = occludes.get(position, 0) | mask
+        sides = []
+        for x, y, z in positions.tolist():
+            mask = 0
+            for side, (dx, dy, dz) in enumerate(Cube.NORMALS):
+                if occludes.get((x + dx, y + dy, z + dz), 0) >> Cube.OPPOSITE[side] & 1:
+                    mask |= 1 << side
+            sides.append(mask)
+        return np.array(sides, dtype=np.int64)
+
+    def _upload_instances(self):
+        """
+        Put every instance in the instance buffer, grouped by mesh
+        """
+        groups = {}
+        for row, key, hidden in zip(self._rows, self._keys, self._hidden_sides().tolist()):
+            groups.setdefault((key, hidden), []).append(row)
+        groups = {k: v for k, v in groups.items() if self._mesh_for(*k) is not None}
+
+        # every mesh draws from the shared atlas, so there's only one texture state to sort by for now
+        self.draw_list = []
+        rows = []
+        for key in sorted(groups, key=lambda x: (self.meshes[x].texture, x)):
+            self.draw_list.append((key, len(rows), len(groups[key])))
+            rows.extend(groups[key])
+        data = np.array(rows, dtype=np.float32).reshape((-1, INSTANCE_FLOATS))
+        GL.glBindBuffer(GL.GL_ARRAY_BUFFER, self.instance_buffer)
+        GL.glBufferData(GL.GL_ARRAY_BUFFER, data.nbytes, data if len(data) else None, GL.GL_DYNAMIC_DRAW)
+        self.dirty = False
+
+    def draw_scene(self, view_matrix, proj=None):
+        """
+        Draw everything in the scene
+
+        :param view_matrix: view matrix (y should be up)
+        :param proj: projection matrix, defaults to the perspective one set by resize
+        :return: how many draw calls it took
+        """
+        if proj is None:
+            proj = self.proj_mat
+        if self._atlas_changes != self.shared_atlas.changes:
+            self._replace_all()
+        self._sync_shared_atlas()
+        if self.dirty:
+            self._upload_instances()
+
+        proj_view = proj * view_matrix  # kept alive while GL reads it through value_ptr
+        GL.glUseProgram(self.scene_shader)
+        GL.glUniformMatrix4fv(1, 1, GL.GL_FALSE, glm.value_ptr(proj_view))
+        GL.glUniform2f(2, *self.shared_atlas.uv_scale)
+        GL.glUniform1f(3, self.time)
+        GL.glBindTexture(GL.GL_TEXTURE_2D, self.texture)
+        GL.glEnable(GL.GL_DEPTH_TEST)
+        for key, first, count in self.draw_list:
+            mesh = self.meshes[key]
+            GL.glBindVertexArray(mesh.vao)
+            GL.glDrawElementsInstancedBaseInstance(GL.GL_TRIANGLES, mesh.count, mesh.index_type, ctypes.c_void_p(0),
+                                                   count, first)
+        GL.glBindVertexArray(0)
+        return len(self.draw_list)
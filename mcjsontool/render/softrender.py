@@ -0,0 +1,183 @@
+import glm
+import numpy as np
+
+from mcjsontool.render.model import BlockModel
+from mcjsontool.render.texture import WorkspaceAtlas
+
+# same camera as ModelRenderer's icons (not imported from there so this works without OpenGL)
+ICON_VIEW = glm.lookAt(glm.vec3(15, 5, 5), glm.vec3(5, 5, 5), glm.vec3(0, 1, 0))
+ICON_PROJECTION = glm.ortho(-10, 10, 10, -10, 0.1, 50)
+
+FRAGMENT_CHUNK = 1 << 22  # max candidate pixels looked at in one go, to bound memory
+ALPHA_DISCARD = 0.01 * 255  # the block fragment shader discards anything more transparent than this
+
+
+def _matrix_columns(matrix):
+    """
+    Turn a glm matrix into a numpy array such that row_vectors @ array == matrix * each vector
+    """
+    return np.array([tuple(matrix[i]) for i in range(4)], dtype=np.float64)
+
+
+def rasterize(triangles, texture, size):
+    """
+    Draw textured triangles into a size x size image, all with numpy.
+
+    Behaves like the block shader with depth testing on: nearest texture sampling (with repeat), fragments more
+    transparent than ALPHA_DISCARD are thrown away, and the nearest fragment wins (the first drawn one on ties,
+    like GL_LESS). Texture coordinates are interpolated perspective correctly.
+
+    Instead of walking triangles one at a time, every pixel in every triangle's bounding box is tested at once
+    (in chunks of FRAGMENT_CHUNK), and depth testing is a sort.
+
+    :param triangles: float array of shape (n, 3, 6), each corner is clip space x, y, z, w and normalized u, v
+    :param texture: uint8 array of shape (height, width, 4)
+    :param size: image size in pixels
+    :return: uint8 array of shape (size, size, 4), bottom row first (like glReadPixels)
+    """
+    image = np.zeros((size * size, 4), dtype=np.uint8)
+    triangles = np.asarray(triangles, dtype=np.float64)
+    if not len(triangles):
+        return image.reshape((size, size, 4))
+
+    w = triangles[..., 3]
+    triangles = triangles[(w > 1e-9).all(axis=1)]  # nothing behind the camera (icons never need real clipping)
+    w = triangles[..., 3]
+    inverse_w = 1 / w
+    screen_x = (triangles[..., 0] * inverse_w + 1) * 0.5 * size
+    screen_y = (triangles[..., 1] * inverse_w + 1) * 0.5 * size
+    depth = (triangles[..., 2] * inverse_w + 1) * 0.5
+    u_over_w = triangles[..., 4] * inverse_w
+    v_over_w = triangles[..., 5] * inverse_w
+
+    x0, x1, x2 = screen_x.T
+    y0, y1, y2 = screen_y.T
+    area = (x1 - x0) * (y2 - y0) - (x2 - x0) * (y1 - y0)
+
+    # pixels whose centers might be inside each triangle
+    min_x = np.clip(np.ceil(screen_x.min(axis=1) - 0.5), 0, size).astype(np.int64)
+    max_x = np.clip(np.floor(screen_x.max(axis=1) - 0.5), -1, size - 1).astype(np.int64)
+    min_y = np.clip(np.ceil(screen_y.min(axis=1) - 0.5), 0, size).astype(np.int64)
+    max_y = np.clip(np.floor(screen_y.max(axis=1) - 0.5), -1, size - 1).astype(np.int64)
+    widths = np.maximum(max_x - min_x + 1, 0)
+    counts = widths * np.maximum(max_y - min_y + 1, 0)
+    counts[np.abs(area) < 1e-12] = 0
+    ends = np.cumsum(counts)
+
+    texture_height, texture_width = texture.shape[:2]
+    texels = texture.reshape((-1, 4))
+    fragment_pixels, fragment_depths, fragment_order, fragment_colors = [], [], [], []
+
+    start = 0
+    while start < len(triangles):
+        base = ends[start] - counts[start]
+        stop = max(start + 1, int(np.searchsorted(ends, base + FRAGMENT_CHUNK, side="right")))
+        indices = np.arange(start, stop)
+        total = int(ends[stop - 1] - base)
+        start = stop
+        if total == 0:
+            continue
+
+        triangle = np.repeat(indices, counts[indices])
+        offset = np.arange(total) - np.repeat(ends[indices] - counts[indices] - base, counts[indices])
+        pixel_x = min_x[triangle] + offset % widths[triangle]
+        pixel_y = min_y[triangle] + offset // widths[triangle]
+        center_x, center_y = pixel_x + 0.5, pixel_y + 0.5
+
+        tx0, tx1, tx2 = x0[triangle], x1[triangle], x2[triangle]
+        ty0, ty1, ty2 = y0[triangle], y1[triangle], y2[triangle]
+        triangle_area = area[triangle]
+        b0 = ((tx2 - tx1) * (center_y - ty1) - (ty2 - ty1) * (center_x - tx1)) / triangle_area
+        b1 = ((tx0 - tx2) * (center_y - ty2) - (ty0 - ty2) * (center_x - tx2)) / triangle_area
+        b2 = ((tx1 - tx0) * (center_y - ty0) - (ty1 - ty0) * (center_x - tx0)) / triangle_area
+        inside = (b0 >= 0) & (b1 >= 0) & (b2 >= 0)
+
+        triangle, pixel_x, pixel_y = triangle[inside], pixel_x[inside], pixel_y[inside]
+        b = np.stack((b0[inside], b1[inside], b2[inside]), axis=1)
+        z = (b * depth[triangle]).sum(axis=1)
+        q = (b * inverse_w[triangle]).sum(axis=1)
+        u = (b * u_over_w[triangle]).sum(axis=1) / q
+        v = (b * v_over_w[triangle]).sum(axis=1) / q
+
+        texel_x = np.floor(u * texture_width).astype(np.int64) % texture_width
+        texel_y = np.floor(v * texture_height).astype(np.int64) % texture_height
+        colors = texels[texel_y * texture_width + texel_x]
+
+        keep = (colors[:, 3] >= ALPHA_DISCARD) & (z >= 0) & (z < 1)
+        fragment_pixels.append((pixel_y * size + pixel_x)[keep])
+        fragment_depths.append(z[keep])
+        fragment_order.append(triangle[keep])
+        fragment_colors.append(colors[keep])
+
+    if fragment_pixels:
+        pixels = np.concatenate(fragment_pixels)
+        order = np.lexsort((np.concatenate(fragment_order), np.concatenate(fragment_depths), pixels))
+        pixels = pixels[order]
+        first = np.flatnonzero(np.r_[True, pixels[1:] != pixels[:-1]])  # nearest fragment of each pixel
+        image[pixels[first]] = np.concatenate(fragment_colors)[order][first]
+    return image.reshape((size, size, 4))
+
+
+class SoftwareRenderer:
+    """
+    Renders block models on the CPU, for machines without a GPU (or without OpenGL 4.3).
+
+    Uses the same compiled vertex data and atlases as :py:class:`mcjsontool.render.glrender.ModelRenderer`, and
+    draws the same icons, just slower. Images come out top row first, like the QImages the offscreen renderer emits.
+    """
+
+    def __init__(self, workspace, shared_atlas=True):
+        """
+        :param workspace: workspace to load from
+        :param shared_atlas: use the workspace-wide atlas (see :py:class:`WorkspaceAtlas`) instead of building a
+                             ModelAtlas for every model
+        """
+        self.workspace = workspace
+        self.use_shared_atlas = shared_atlas
+
+    def _compile(self, model: BlockModel):
+        """
+        :return: vertices from compile_to_array (with normalized uvs) and the atlas pixels
+        """
+        if self.use_shared_atlas:
+            shared_atlas = WorkspaceAtlas.for_workspace(self.workspace)
+            with shared_atlas.lock:
+                atlas = shared_atlas.add_model(model, self.workspace)
+                pixels, uv_scale = shared_atlas.data, shared_atlas.uv_scale
+        else:
+            atlas = model.create_model_atlas(self.workspace)
+            pixels = np.asarray(atlas.data, dtype=np.uint8).reshape((atlas.size[1], atlas.size[0], 4))
+            uv_scale = 1, 1
+        vertices = model.compile_to_array(atlas).astype(np.float64)
+        vertices[:, 4:6] *= uv_scale
+        vertices[:, 8] *= uv_scale[1]
+        return vertices, pixels
+
+    def render(self, model: BlockModel, view_matrix, transform_name, proj, size=128, time=0):
+        """
+        Render a model
+
+        :param model: the blockmodel
+        :param view_matrix: view matrix (y should be up)
+        :param transform_name: transform name in model
+        :param proj: projection matrix
+        :param size: image size in pixels
+        :param time: animation time in ticks, like ModelRenderer.time
+        :return: uint8 array of shape (size, size, 4), top row first
+        """
+        vertices, pixels = self._compile(model)
+        matrix = _matrix_columns(proj * view_matrix * model.transforms[transform_name])
+        vertices[:, :4] = vertices[:, :4] @ matrix
+        frame = np.mod(np.floor(time / vertices[:, 7]), vertices[:, 6])  # same as the vertex shader
+        vertices[:, 5] += frame * vertices[:, 8]
+        return rasterize(vertices[:, :6].reshape((-1, 3, 6)), pixels, size)[::-1]
+
+    def render_icon(self, model: BlockModel, size=128):
+        """
+        Render a block model how it looks as an item, like ModelRenderer.draw_model_icon
+
+        :param model: the blockmodel
+        :param size: image size in pixels
+        :return: uint8 array of shape (size, size, 4), top row first
+        """
+        return self.render(model, ICON_VIEW, "gui", ICON_PROJECTION, size)
@@ -1,188 +1,582 @@
+import json
 import math
+import os
+import threading
+import weakref
 import numpy as np
 
 from ..resource.workspace import Workspace
 from PIL import Image
 import io
 
+MIP_LEVELS = 2  # mipmap levels below the full size when atlases are mipmapped (16px textures go down to 4px)
+
 
 class Texture:
     """
     Holds a texture with width, height and its texture data in rgba.
+
+    Animated textures (ones with a .png.mcmeta) hold every frame as a vertical strip of w by w frames, already in the
+    order they're shown in: frames the mcmeta shows for longer are repeated, so frame n of the strip is shown from
+    tick n * frametime. Shaders can pick the frame themselves, so the strip only has to be uploaded once.
     """
     def __init__(self):
         self.w = 0
         self.h = 0
         self.data = None  # i = y * (w * 4) + x * 4 = (r, g, b, a)
+        self.fingerprint = None
+        self.frames = 1  # frames in the strip
+        self.frametime = 1  # ticks each frame in the strip is shown for
+
+    @property
+    def animated(self):
+        return self.frames > 1
+
+    def _load_animation(self, pixels, animation):
+        """
+        Lay out an animated texture's frames in display order
+
+        :param pixels: the image, as a (h, w, 4) uint8 array
+        :param animation: the animation section of its mcmeta
+        """
+        count = max(1, self.h // self.w)
+        default_time = max(1, int(animation.get("frametime", 1)))
+        sequence = []
+        for frame in animation.get("frames", range(count)):
+            if isinstance(frame, dict):
+                sequence.append((int(frame["index"]), max(1, int(frame.get("time", default_time)))))
+            else:
+                sequence.append((int(frame), default_time))
+        sequence = [x for x in sequence if 0 <= x[0] < count] or [(0, default_time)]
+
+        self.frametime = 0
+        for _, time in sequence:
+            self.frametime = math.gcd(self.frametime, time)
+        order = [index for index, time in sequence for _ in range(time // self.frametime)]
+        frames = pixels[:count * self.w].reshape((count, self.w, self.w, 4))[order]
+        self.frames = len(order)
+        self.h = self.w * self.frames
+        self.data = frames.tobytes()
 
     @classmethod
     def load_from_file(cls, workspace, location, enforce_square=True):
         """
         Load a texture from a file
 
-        :param enforce_square: if true, crop image to square (eliminates problems in things like animated textures)
+        Decoded textures are cached on the workspace (see texture_cache, which has hit/miss counters, keyed by path and
+        enforce_square), so loading the same texture again is free while its file stays the same.
+
+        .. danger:
+            The returned texture is shared with the cache, don't modify it!
+
+        :param enforce_square: if true, crop non-square images that aren't animated to square
         :param workspace: workspace to load from
         :type workspace: Workspace
 
         :param location: location of file
         :return:
         """
-        with workspace.get_file(location, 'rb') as f:
+        realpath = os.path.normpath(location if not hasattr(location, "get_real_path") else location.get_real_path())
+        fingerprint = workspace.file_fingerprint(realpath), workspace.file_fingerprint(realpath + ".mcmeta")
+        key = realpath, enforce_square
+        self = workspace.texture_cache.get(key)
+        if self is not None and self.fingerprint == fingerprint:
+            return self
+
+        with workspace.get_file(realpath, 'rb') as f:
             im: Image.Image = Image.open(io.BytesIO(f.read()))
         im.load()
         self = cls()
+        self.fingerprint = fingerprint
+
+        animation = None
+        if fingerprint[1] is not None:
+            try:
+                with workspace.get_file(realpath + ".mcmeta") as f:
+                    animation = json.load(f).get("animation")
+            except ValueError:
+                pass  # broken mcmeta, treat it as not animated
 
-        if im.width != im.height and enforce_square:
-            # for now we just crop out animation frames
-            im.crop((0, 0, im.width-1, im.width-1))
+        if im.width != im.height and enforce_square and animation is None:
+            size = min(im.width, im.height)
+            im = im.crop((0, 0, size, size))
 
         self.w = im.width
         self.h = im.height
-        if len(im.getbands()) == 3:
-            im.putalpha(255)
+        if im.mode != "RGBA":
+            im = im.convert("RGBA")
         self.data = im.tobytes()
+        if animation is not None and self.h >= 2 * self.w:
+            self._load_animation(np.frombuffer(self.data, dtype=np.uint8).reshape((self.h, self.w, 4)), animation)
+        workspace.texture_cache.put(key, self)
         return self
 
 
-class ModelAtlas:
-    TEX_SIZE = 128
+class SkylinePacker:
+    """
+    Packs rectangles into a fixed width area using the skyline bottom-left heuristic: the top edge of everything
+    packed so far is kept as a list of horizontal segments (the skyline), and each new rectangle goes wherever its top
+    ends up lowest.
 
+    Rectangles never move once placed, so it packs incrementally, and the height can be raised at any time (which is
+    how atlases grow without a relayout).
     """
-    A ModelAtlas holds a bunch of textures on a grid, so the shader only needs one texture per block.
 
-    Representation is a grid of 16x16 textures. (animated textures only use their first frame)
-    Size is calculated once, and drawn at construction. Otherwise similar api to a :py:class:`Texture`.
+    def __init__(self, width, height):
+        self.width = width
+        self.height = height
+        self.skyline = [[0, 0, width]]  # x, y, width segments, left to right
+        self.used_area = 0
+
+    def _fit(self, index, w):
+        """
+        :return: the y a w wide rectangle would sit at with its left edge at skyline segment index, or None
+        """
+        x = self.skyline[index][0]
+        if x + w > self.width:
+            return None
+        y = 0
+        remaining = w
+        while remaining > 0:
+            y = max(y, self.skyline[index][1])
+            remaining -= self.skyline[index][2]
+            index += 1
+        return y
+
+    def insert(self, w, h):
+        """
+        Find space for a rectangle
+
+        :return: x, y of its top left corner, or None if it doesn't fit (make height bigger and try again)
+        """
+        best, best_index = None, None
+        for i in range(len(self.skyline)):
+            y = self._fit(i, w)
+            if y is None or y + h > self.height:
+                continue
+            if best is None or (y + h, self.skyline[i][0]) < (best[1] + h, best[0]):
+                best, best_index = (self.skyline[i][0], y), i
+        if best is None:
+            return None
+
+        x, y = best
+        self.skyline.insert(best_index, [x, y + h, w])
+        i = best_index + 1
+        while i < len(self.skyline) and self.skyline[i][0] < x + w:
+            overlap = x + w - self.skyline[i][0]
+            if overlap >= self.skyline[i][2]:
+                del self.skyline[i]
+            else:
+                self.skyline[i][0] += overlap
+                self.skyline[i][2] -= overlap
+                break
+        # merge neighbours at the same height
+        i = 0
+        while i < len(self.skyline) - 1:
+            if self.skyline[i][1] == self.skyline[i + 1][1]:
+                self.skyline[i][2] += self.skyline[i + 1][2]
+                del self.skyline[i + 1]
+            else:
+                i += 1
+        self.used_area += w * h
+        return x, y
+
+    @property
+    def used_height(self):
+        return max(x[1] for x in self.skyline)
+
+    @property
+    def efficiency(self):
+        """
+        :return: fraction of the area up to the highest rectangle that is actually covered by rectangles
+        """
+        height = self.used_height
+        return self.used_area / (self.width * height) if height else 1.0
+
+
+def _next_power_of_two(x):
+    return 1 << max(0, math.ceil(math.log2(max(x, 1))))
+
+
+def _round_up(x, multiple):
+    return -(-x // multiple) * multiple
+
+
+def _draw_padded(data, cell, pixels, padding):
+    """
+    Draw a texture into its cell of an atlas, repeating its edge pixels out to the sides of the cell, so filtering
+    and mipmaps near the border of the texture don't bleed in its neighbours.
+
+    :param data: the atlas, uint8 array of shape (h, w, 4)
+    :param cell: x, y, w, h of the cell, the texture goes padding pixels in from its top left
+    :param pixels: the texture, uint8 array of shape (h, w, 4)
+    :param padding: how far in the texture is
+    """
+    x, y, w, h = cell
+    texture_h, texture_w = pixels.shape[:2]
+    data[y:y + h, x:x + w] = np.pad(pixels, ((padding, h - texture_h - padding), (padding, w - texture_w - padding),
+                                             (0, 0)), mode="edge")
+
+
+def build_mip_chain(pixels, levels):
+    """
+    Build the mipmaps of an image, each level averaging 2x2 blocks of the one before. Colours are weighted by alpha,
+    so transparent pixels (which are usually black) don't darken the edges of cutouts.
+
+    :param pixels: uint8 array of shape (h, w, 4), both sides divisible by 2 ** levels
+    :param levels: how many levels to make below the full size
+    :return: list of uint8 arrays, starting with pixels itself
     """
+    chain = [pixels]
+    for _ in range(levels):
+        h, w = chain[-1].shape[:2]
+        blocks = chain[-1].reshape((h // 2, 2, w // 2, 2, 4)).astype(np.float32)
+        alpha = blocks[..., 3:].sum(axis=(1, 3))
+        color = (blocks[..., :3] * blocks[..., 3:]).sum(axis=(1, 3)) / np.maximum(alpha, 1)
+        chain.append(np.concatenate((color, alpha / 4), axis=2).round().astype(np.uint8))
+    return chain
 
-    def __init__(self, textures):
+
+class ModelAtlas:
+    """
+    A ModelAtlas holds a bunch of textures packed into one image, so the shader only needs one texture per block.
+
+    Textures are packed with a :py:class:`SkylinePacker`, so any mix of sizes works, including non-square ones like
+    animated strips (which only use their first frame). More can be added later with add: nothing already packed
+    moves, but the atlas gets taller (changing size, and so uv_transform) if it runs out of room.
+    Otherwise similar api to a :py:class:`Texture`, with data as a (h, w, 4) uint8 array.
+
+    With mip_levels set, every texture gets a cell padded out with copies of its edges and lined up on a
+    2 ** mip_levels grid, so no level of mip_chain mixes two textures together.
+    """
+
+    def __init__(self, textures, mip_levels=0):
         """
         Create a new ModelAtlas
 
         :param textures: dictionary of names to :py:class:`Texture` instances
+        :param mip_levels: how many mipmap levels mip_chain will be asked for (0 for no padding)
         """
-        self.textures = textures
-        self.data = None
-        self.size = [-1, -1]
+        self.textures = {}
         self._positions = {}
+        self.mip_levels = mip_levels
+        self.alignment = 1 << mip_levels
+        self.padding = self.alignment if mip_levels else 0
+
+        # pick a width that fits the widest texture and makes the whole thing roughly square
+        cells = [self._cell_size(x) for x in textures.values()]
+        area = sum(w * h for w, h in cells)
+        width = _next_power_of_two(max([math.sqrt(area), self.alignment] + [w for w, h in cells]))
+        height = max(_next_power_of_two(area / width), self.alignment) if area else 16
+        self.packer = SkylinePacker(width, height)
+        self.data = np.zeros((height, width, 4), dtype=np.uint8)
+        self.size = [width, height]
+
+        # tallest first packs tighter
+        for name, texture in sorted(textures.items(), key=lambda x: (-x[1].h, -x[1].w, x[0])):
+            self.add(name, texture)
+
+    def _cell_size(self, texture):
+        return (_round_up(texture.w + 2 * self.padding, self.alignment),
+                _round_up(texture.h + 2 * self.padding, self.alignment))
+
+    def add(self, name, texture):
+        """
+        Add a texture to the atlas, growing it if needed
 
-        self._layout()
+        :param name: name of the texture
+        :param texture: a :py:class:`Texture`
+        """
+        w, h = self._cell_size(texture)
+        position = self.packer.insert(w, h)
+        if position is None:
+            if w > self.size[0]:
+                raise ValueError(f"Texture is too wide for the atlas ({w} > {self.size[0]})")
+            height = self.size[1]
+            while position is None:
+                height *= 2
+                self.packer.height = height
+                position = self.packer.insert(w, h)
+            data = np.zeros((height, self.size[0], 4), dtype=np.uint8)
+            data[:self.size[1]] = self.data
+            self.data = data
+            self.size[1] = height
+
+        x, y = position
+        _draw_padded(self.data, (x, y, w, h),
+                     np.frombuffer(texture.data, dtype=np.uint8).reshape((texture.h, texture.w, 4)), self.padding)
+        self.textures[name] = texture
+        self._positions[name] = x + self.padding, y + self.padding
+
+    def mip_chain(self):
+        """
+        :return: data and its mip_levels mipmaps, see :py:func:`build_mip_chain`
+        """
+        return build_mip_chain(self.data, self.mip_levels)
 
-    def _subgrid_layout(self, smaller, new_size, small_size, extra=()):
+    @property
+    def efficiency(self):
+        """
+        :return: fraction of the atlas covered by textures
         """
-        Layout a subgrid
+        return self.packer.used_area / (self.size[0] * self.size[1])
 
-        :param smaller: list of smaller tiles
-        :param new_size: size to pack to
-        :param small_size: incoming size
-        :param extra: things that are already new_size
-        :return: list of locations
+    def uv_for(self, tex, u, v):
         """
+        Get the UV for a texture in this atlas
 
-        size_factor = new_size / small_size
-        grids = [
-            []
-        ]
+        :param tex: texture name
+        :param u: u, in model units (0-16)
+        :param v: v, in model units (0-16)
+        :return: U, V (floats)
+        """
+        x, y, scale_u, scale_v = self.uv_transform(tex)
+        return x + u * scale_u, y + v * scale_v
 
-        c_pos = [0, 0]
+    def uv_transform(self, tex):
+        """
+        Get the transform from a texture's UVs to atlas UVs, for converting lots of them at once
 
-        for i in smaller:
-            grids[-1].append((i, c_pos.copy()))
-            c_pos[0] += small_size
-            if c_pos[0] == size_factor * small_size:
-                c_pos[1] += small_size
-                c_pos[0] = 0
-            if c_pos[1] == size_factor * small_size:
-                grids.append([])
-                c_pos = [0, 0]
+        :param tex: texture name
+        :return: x, y, scale_u, scale_v; so U, V = x + u * scale_u, y + v * scale_v
+        """
+        x, y = self._positions[tex]
+        scale = self.textures[tex].w / 16  # v uses the width too, so animated strips show their first frame
+        return x / self.size[0], y / self.size[1], scale / self.size[0], scale / self.size[1]
+
+    def animation(self, tex):
+        """
+        :param tex: texture name
+        :return: frames, frametime of the texture (see :py:class:`Texture`)
+        """
+        return self.textures[tex].frames, self.textures[tex].frametime
 
-        if not grids[-1]:
-            grids = grids[:-1]
 
-        for i in extra:
-            grids.append([(i, [0, 0])])
+class WorkspaceAtlas:
+    WIDTH = 2048
+    INITIAL_HEIGHT = 256
+    REPACK_WASTE = 0.5  # repack once old cells of textures are this much of the packed area
 
-        return grids
+    """
+    A WorkspaceAtlas is one atlas shared by every model in a workspace, so switching models doesn't need a new texture
+    and lots of models can be drawn with one bound texture.
 
-    def _blit(self, texture, to):
+    Textures are packed in once (with a :py:class:`SkylinePacker`) the first time a model uses them, and the atlas
+    grows downwards when it runs out of room. A texture that changes size gets a new cell, and once enough of the
+    atlas is old cells (see REPACK_WASTE) everything is packed again. Since growing changes the size, UVs are handed
+    out in pixels: multiply by uv_scale to normalize them (the block shader does this with its UVScale uniform).
+
+    Renderers keep their copy up to date using generation (bumped whenever data is reallocated, meaning everything
+    has to be reuploaded) and updates (the rectangles changed since then). changes is bumped whenever a texture
+    that was already in the atlas changes, so anything holding on to rects (or to what the pixels look like) knows to
+    look again.
+
+    Like a :py:class:`ModelAtlas`, with mip_levels set textures are padded and aligned so they can be mipmapped.
+    Updates are whole aligned cells then, so each can have its mipmaps built on its own (see build_mip_chain).
+    """
+
+    _atlases = weakref.WeakKeyDictionary()
+
+    @classmethod
+    def for_workspace(cls, workspace, mip_levels=0):
         """
-        Blit a texture to the atlas. Also updates the entry in the _positions table
+        Get the atlas shared by everything using this workspace
 
-        .. danger:
-            Only works while laying out, i.e. when the array is 3d
+        :param workspace: the workspace
+        :param mip_levels: mipmap levels the atlas is padded for, each setting gets its own atlas
+        :rtype: WorkspaceAtlas
+        """
+        atlases = cls._atlases.setdefault(workspace, {})
+        atlas = atlases.get(mip_levels)
+        if atlas is None:
+            atlas = atlases[mip_levels] = cls(mip_levels)
+        return atlas
+
+    def __init__(self, mip_levels=0):
+        self.size = [WorkspaceAtlas.WIDTH, WorkspaceAtlas.INITIAL_HEIGHT]
+        self.data = np.zeros((self.size[1], self.size[0], 4), dtype=np.uint8)
+        self.generation = 0
+        self.changes = 0
+        self.updates = []  # (x, y, w, h) of cells changed since the last reallocation
+        self.lock = threading.RLock()
+        self.mip_levels = mip_levels
+        self.alignment = 1 << mip_levels
+        self.padding = self.alignment if mip_levels else 0
+        self.dead_area = 0  # area of cells left behind by textures that changed size
+
+        self._entries = {}  # real path -> (fingerprint, (x, y, w, h), (frames, frametime), cell)
+        self.packer = SkylinePacker(*self.size)
+
+    @property
+    def uv_scale(self):
+        return 1 / self.size[0], 1 / self.size[1]
+
+    def _grow(self, min_height):
+        height = self.size[1]
+        while height < min_height:
+            height *= 2
+        data = np.zeros((height, self.size[0], 4), dtype=np.uint8)
+        data[:self.size[1]] = self.data
+        self.data = data
+        self.size[1] = height
+        self.generation += 1
+        self.updates.clear()
+
+    def _allocate(self, w, h):
+        """
+        Find space for a w by h texture
 
-        :param texture: blit me
-        :param to: here
+        :return: x, y, w, h of its cell (the texture goes padding pixels in)
         """
-        self._positions[texture] = to
-        self.data[to[1]:to[1] + self.textures[texture].h, to[0]:to[0] + self.textures[texture].w] = \
-            np.frombuffer(self.textures[texture].data, dtype=np.uint8).reshape((self.textures[texture].h,
-                                                                                self.textures[texture].w, 4))
-        # that crazy thing does a blit with numpy magic (maybe) (hopefully)
+        w = _round_up(w + 2 * self.padding, self.alignment)
+        h = _round_up(h + 2 * self.padding, self.alignment)
+        if w > self.size[0]:
+            raise ValueError(f"Texture is too wide for the atlas ({w} > {self.size[0]})")
+        position = self.packer.insert(w, h)
+        while position is None:
+            self._grow(self.size[1] * 2)
+            self.packer.height = self.size[1]
+            position = self.packer.insert(w, h)
+        return position + (w, h)
+
+    @property
+    def efficiency(self):
+        """
+        :return: fraction of the atlas covered by textures (not counting old versions of ones that changed size)
+        """
+        return (self.packer.used_area - self.dead_area) / (self.size[0] * self.size[1])
 
-    def _draw_grid(self, c_pos, grid):
+    def repack(self):
         """
-        Recursively draw this grid, starting at c_pos
+        Pack every texture again from scratch, getting rid of the cells left behind by textures that changed size.
 
-        :param c_pos: start at
-        :param grid: draw this
+        Everything moves, so this bumps both generation and changes.
         """
-        for element in grid:
-            to_draw, at = element
-            a_pos = c_pos[0] + at[0], c_pos[1] + at[1]
-            if type(to_draw) is str:
-                self._blit(to_draw, a_pos)
-            else:
-                self._draw_grid(a_pos, grid)
+        with self.lock:
+            old = self.data
+            self.size[1] = WorkspaceAtlas.INITIAL_HEIGHT
+            self.data = np.zeros((self.size[1], self.size[0], 4), dtype=np.uint8)
+            self.packer = SkylinePacker(*self.size)
+            entries = sorted(self._entries.items(), key=lambda x: -x[1][3][3])  # tallest first packs tighter
+            for realpath, (fingerprint, rect, animation, cell) in entries:
+                x, y, w, h = cell
+                new_cell = self._allocate(rect[2], rect[3])
+                self.data[new_cell[1]:new_cell[1] + h, new_cell[0]:new_cell[0] + w] = old[y:y + h, x:x + w]
+                rect = (new_cell[0] + self.padding, new_cell[1] + self.padding, rect[2], rect[3])
+                self._entries[realpath] = (fingerprint, rect, animation, new_cell)
+            self.dead_area = 0
+            self.generation += 1
+            self.changes += 1
+            self.updates.clear()
+
+    def clear(self):
+        """
+        Take every texture out of the atlas, keeping its size, so it can be reused for other models.
 
-    def _layout(self):
+        Bumps both generation and changes, like repack.
+        """
+        with self.lock:
+            for x, y, w, h in [x[3] for x in self._entries.values()]:
+                self.data[y:y + h, x:x + w] = 0
+            self._entries.clear()
+            self.packer = SkylinePacker(*self.size)
+            self.dead_area = 0
+            self.generation += 1
+            self.changes += 1
+            self.updates.clear()
+
+    def mip_chain(self):
         """
-        Layout the modelatlas
+        :return: data and its mip_levels mipmaps, see :py:func:`build_mip_chain`
+        """
+        return build_mip_chain(self.data, self.mip_levels)
+
+    def add_texture(self, workspace, location):
         """
+        Make sure a texture is in the atlas (and is the current version of it)
 
-        size_filtered = {}
-        sizes = []
-        for i in self.textures:
-            if self.textures[i].w in size_filtered:
-                size_filtered[self.textures[i].w].append(i)
+        :param workspace: workspace to load from
+        :param location: location of the texture
+        :return: x, y, w, h in pixels
+        """
+        texture = Texture.load_from_file(workspace, location, True)
+        realpath = os.path.normpath(location if not hasattr(location, "get_real_path") else location.get_real_path())
+        with self.lock:
+            entry = self._entries.get(realpath)
+            if entry is not None and entry[0] == texture.fingerprint:
+                return entry[1]
+            if entry is not None and entry[1][2:] == (texture.w, texture.h):
+                cell = entry[3]  # changed but same size, draw over the old one
             else:
-                size_filtered[self.textures[i].w] = [i]
-                sizes.append(self.textures[i].w)
-        sizes.sort()
-        grids = []
-        previous_size = sizes[0]
-        for i in sizes:
-            grids = self._subgrid_layout(grids, i, previous_size, size_filtered[i])
-            previous_size = i
-
-        h_size = sizes[-1]
-        row_count = min(len(grids), ModelAtlas.TEX_SIZE // h_size)
-        if row_count < 1:
-            row_count = 1
-        h_size = row_count * sizes[-1]
-        columns = math.ceil(len(grids)/row_count)
-
-        self.data = np.zeros((columns*sizes[-1], h_size, 4))
-
-        c_pos = [0, 0]
-        for i in grids:
-            self._draw_grid(c_pos, i)
-            c_pos[0] += sizes[-1]
-            if c_pos[0] == h_size:
-                c_pos[0] = 0
-                c_pos[1] += sizes[-1]
-
-        self.data = self.data.reshape(4*h_size*columns*sizes[-1])
-        self.size = [h_size, columns*sizes[-1]]
+                cell = self._allocate(texture.w, texture.h)
+                if entry is not None:
+                    self.dead_area += entry[3][2] * entry[3][3]
+            pixels = np.frombuffer(texture.data, dtype=np.uint8).reshape((texture.h, texture.w, 4))
+            _draw_padded(self.data, cell, pixels, self.padding)
+            rect = (cell[0] + self.padding, cell[1] + self.padding, texture.w, texture.h)
+            self.updates.append(cell)
+            self._entries[realpath] = (texture.fingerprint, rect, (texture.frames, texture.frametime), cell)
+            if entry is not None:
+                self.changes += 1
+                if self.dead_area > self.packer.used_area * WorkspaceAtlas.REPACK_WASTE:
+                    self.repack()
+            return self._entries[realpath][1]
+
+    def add_model(self, model, workspace):
+        """
+        Add all the textures a model uses
+
+        :param model: the model
+        :param workspace: workspace to load textures from
+        :return: an AtlasView to compile the model with
+        """
+        rects, animations = {}, {}
+        with self.lock:
+            textures = model.get_used_textures()
+            for v in textures.values():
+                self.add_texture(workspace, v)
+            for k, v in textures.items():  # after adding them all, in case adding one repacked the others
+                rects[k], animations[k] = self._entries[os.path.normpath(v.get_real_path())][1:3]
+        return AtlasView(self, rects, animations)
+
+
+class AtlasView:
+    """
+    Maps a model's texture variables to their places in a :py:class:`WorkspaceAtlas`. Has the same uv_for as a
+    :py:class:`ModelAtlas`, but gives pixels.
+    """
+
+    def __init__(self, atlas, rects, animations=None):
+        self.atlas = atlas
+        self.rects = rects
+        self.animations = animations or {}
 
     def uv_for(self, tex, u, v):
         """
-        Get the UV for a texture in this atlas
+        Get the UV for a texture in the atlas
 
         :param tex: texture name
-        :param u: u, in pixels
-        :param v: v, in pixels
-        :return: U, V (floats)
+        :param u: u, in model units (0-16)
+        :param v: v, in model units (0-16)
+        :return: U, V (in atlas pixels)
+        """
+        x, y, scale_u, scale_v = self.uv_transform(tex)
+        return x + u * scale_u, y + v * scale_v
+
+    def uv_transform(self, tex):
+        """
+        Get the transform from model UVs to atlas pixels, for converting lots of them at once
+
+        :param tex: texture name
+        :return: x, y, scale_u, scale_v; so U, V = x + u * scale_u, y + v * scale_v
+        """
+        x, y, w, h = self.rects[tex]
+        scale = w / 16  # v uses the width too, so animated strips show their first frame
+        return x, y, scale, scale
+
+    def animation(self, tex):
+        """
+        :param tex: texture name
+        :return: frames, frametime of the texture (see :py:class:`Texture`)
         """
-        c_pos = self._positions[tex]
-        a_pos = c_pos[0] + u, c_pos[1] + v
-        return a_pos[0] / self.size[0], a_pos[1] / self.size[1]
+        return self.animations.get(tex, (1, 1))
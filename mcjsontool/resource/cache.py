@@ -0,0 +1,93 @@
+import collections
+import threading
+
+
+class LRUCache:
+    """
+    A thread-safe least-recently-used cache with a size budget.
+
+    By default every entry has a size of 1 (so max_size is an entry count), pass sizeof to budget by something else,
+    like bytes. Keeps hit/miss counters so you can see if it's doing anything.
+    """
+
+    def __init__(self, max_size, sizeof=None, on_evict=None):
+        """
+        Create a new LRUCache
+
+        :param max_size: total size allowed before old entries are evicted
+        :param sizeof: function giving the size of a value, defaults to 1 per entry
+        :param on_evict: function called with (key, value) when an entry is evicted or discarded
+        """
+        self.max_size = max_size
+        self.sizeof = sizeof or (lambda x: 1)
+        self.on_evict = on_evict
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+
+        self._entries = collections.OrderedDict()  # key -> (value, size)
+        self._lock = threading.RLock()
+
+    def get(self, key, default=None):
+        """
+        Get a value, marking it as recently used
+
+        :param key: the key
+        :param default: returned if the key isn't cached
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return default
+            self.hits += 1
+            self._entries.move_to_end(key)
+            return entry[0]
+
+    def put(self, key, value):
+        """
+        Add or replace a value, evicting the least recently used ones if over budget.
+        Values bigger than the whole budget aren't cached.
+        """
+        size = self.sizeof(value)
+        with self._lock:
+            self.discard(key)
+            if size > self.max_size:
+                return
+            self._entries[key] = (value, size)
+            self.size += size
+            while self.size > self.max_size:
+                old_key, (old_value, old_size) = self._entries.popitem(last=False)
+                self.size -= old_size
+                if self.on_evict is not None:
+                    self.on_evict(old_key, old_value)
+
+    def discard(self, key):
+        """
+        Remove a value if it is cached
+        """
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is None:
+                return
+            self.size -= entry[1]
+            if self.on_evict is not None:
+                self.on_evict(key, entry[0])
+
+    def clear(self):
+        with self._lock:
+            for key in list(self._entries):
+                self.discard(key)
+
+    def stats(self):
+        """
+        :return: dictionary of hits, misses, entries and size
+        """
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "entries": len(self._entries), "size": self.size}
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def __len__(self):
+        return len(self._entries)
@@ -1,24 +1,74 @@
+from . import watcher
 from .workspace import FileProvider
+import hashlib
 import zipfile
+import zlib
 import os
 
 
 class JarFileProvider(FileProvider):
+    FINGERPRINT_TAIL = 4096  # enough to cover the end of central directory record and the end of the directory
+
     def __init__(self, path_to_jar):
         self.path = os.path.abspath(path_to_jar)
-        self.jarfile = zipfile.ZipFile(os.path.abspath(path_to_jar))
+        self._jarfile = None
+        self._open()
+
+    def _open(self):
+        """
+        Open the jar and build its path index. Done once on first use, since the jar's contents don't change.
+
+        The index maps each entry name to its ZipInfo, so lookups are a dict hit instead of a scan of namelist().
+        """
+        self._jarfile = zipfile.ZipFile(self.path)
+        self.index = {x.filename: x for x in self._jarfile.infolist()}
+        self.asset_paths = [x for x in self.index if x.startswith("assets") and ".mcassetsroot" not in x]
+
+    @property
+    def jarfile(self):
+        if self._jarfile is None:
+            self._open()
+        return self._jarfile
 
     def provides_path(self, path):
+        if self._jarfile is None:
+            self._open()
         path = path.replace(os.path.sep, "/")  # jarfiles are wierd, okay?
-        return path in self.jarfile.namelist()
+        return path in self.index
 
     def open_path(self, path, mode="r"):
         mode = mode.replace("b", "")
         path = path.replace(os.path.sep, "/")  # jarfiles are wierd, okay?
-        return self.jarfile.open(path, mode)
+        return self.jarfile.open(self.index[path], mode)
 
     def list_paths(self):
-        return filter(lambda x: x.startswith("assets") and ".mcassetsroot" not in x, self.jarfile.namelist())
+        if self._jarfile is None:
+            self._open()
+        return self.asset_paths
+
+    def source_key(self):
+        return "jar", self.path
+
+    def path_fingerprint(self, path):
+        if self._jarfile is None:
+            self._open()
+        info = self.index.get(path.replace(os.path.sep, "/"))
+        if info is None:
+            return None
+        return info.CRC, info.file_size
+
+    def fingerprint(self):
+        """
+        mtime, size and a CRC of the tail of the jar (which holds the central directory)
+        """
+        try:
+            stat = os.stat(self.path)
+            with open(self.path, "rb") as f:
+                f.seek(max(0, stat.st_size - JarFileProvider.FINGERPRINT_TAIL))
+                crc = zlib.crc32(f.read())
+        except OSError:
+            return None
+        return stat.st_mtime_ns, stat.st_size, crc
 
     @classmethod
     def create_edit_widget(cls, parent):
@@ -26,17 +76,22 @@ class JarFileProvider(FileProvider):
 
     def __getstate__(self):
         odict = self.__dict__.copy()
-        del odict["jarfile"]
+        for i in ("_jarfile", "index", "asset_paths"):
+            odict.pop(i, None)
         return odict
 
     def __setstate__(self, state):
+        state.pop("jarfile", None)
         self.__dict__.update(state)
-        self.jarfile = zipfile.ZipFile(state["path"])
+        self._jarfile = None  # opened lazily, so loading a workspace doesn't read every jar's central directory
 
 
 class FolderFileProvider(FileProvider):
+    mutable = True
+
     def __init__(self, folder):
         self.folder = os.path.abspath(folder)
+        self._watcher = None
 
     def open_path(self, path, mode="r"):
         return open(os.path.join(self.folder, path), mode)
@@ -51,10 +106,61 @@ class FolderFileProvider(FileProvider):
                                     map(lambda x: os.path.relpath(os.path.join(root, x), self.folder), files)))
         return all_files
 
+    def source_key(self):
+        return "folder", self.folder
+
+    def path_fingerprint(self, path):
+        try:
+            stat = os.stat(os.path.join(self.folder, path))
+        except OSError:
+            return None
+        return stat.st_mtime_ns, stat.st_size
+
+    def fingerprint(self):
+        """
+        Hash of the mtimes of every directory under assets. Adding or removing a file changes its directory's mtime,
+        so this only needs to stat directories, not every file.
+        """
+        digest = hashlib.sha1()
+        stack = [os.path.join(self.folder, "assets")]
+        while stack:
+            directory = stack.pop()
+            try:
+                digest.update(f"{directory}:{os.stat(directory).st_mtime_ns};".encode())
+                with os.scandir(directory) as it:
+                    stack.extend(x.path for x in it if x.is_dir(follow_symlinks=False))
+            except OSError:
+                continue
+        return digest.hexdigest()
+
+    def watch(self, callback):
+        self.unwatch()
+        self._watcher = watcher.create_watcher(self.folder, callback)
+        self._watcher.start()
+        return True
+
+    @property
+    def watching(self):
+        return self._watcher is not None
+
+    def unwatch(self):
+        if self._watcher is not None:
+            self._watcher.stop()
+            self._watcher = None
+
     @classmethod
     def create_edit_widget(cls, parent):
         return fileloaderui.FolderEditWidget(parent)
 
+    def __getstate__(self):
+        odict = self.__dict__.copy()
+        odict.pop("_watcher", None)
+        return odict
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._watcher = None
+
 
 fileloaders = [JarFileProvider, FolderFileProvider]
 from ..ui.workspace import fileloaderui
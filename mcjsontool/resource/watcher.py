@@ -0,0 +1,264 @@
+import abc
+import ctypes
+import ctypes.util
+import os
+import select
+import struct
+import sys
+import threading
+
+POLL_INTERVAL = 2.0
+DEBOUNCE_TIME = 0.2
+
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_ISDIR = 0x40000000
+
+_EVENT_HEADER = struct.Struct("iIII")
+
+
+class FolderWatcher(metaclass=abc.ABCMeta):
+    """
+    Watches the assets folder inside a folder for changes, and calls back with batches of them.
+
+    Runs on its own daemon thread. The callback gets (added, removed, modified), each a list of paths relative to the
+    folder (so they look like the ones from FolderFileProvider.list_paths)
+    """
+
+    def __init__(self, folder, callback):
+        self.folder = folder
+        self.callback = callback
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._pending = {}
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread.is_alive() and self._thread is not threading.current_thread():
+            self._thread.join()
+
+    @abc.abstractmethod
+    def _run(self):
+        """
+        Watch until stopped, sending batches of changes to the callback. Runs on the watcher's thread.
+        """
+        pass
+
+    def _scan(self):
+        """
+        Snapshot every file under assets
+
+        :return: dictionary of relative path to (mtime, size)
+        """
+        snapshot = {}
+        for root, _, files in os.walk(os.path.join(self.folder, "assets")):
+            for name in files:
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                snapshot[os.path.relpath(path, self.folder)] = (stat.st_mtime_ns, stat.st_size)
+        return snapshot
+
+    def _record(self, path, kind):
+        """
+        Record a change, merging it with any change to the same path that hasn't been sent yet.
+
+        :param path: relative path
+        :param kind: one of "added", "removed" or "modified"
+        """
+        previous = self._pending.get(path)
+        if kind == "added":
+            self._pending[path] = "modified" if previous == "removed" else "added"
+        elif kind == "removed":
+            if previous == "added":
+                del self._pending[path]
+            else:
+                self._pending[path] = "removed"
+        elif previous is None:
+            self._pending[path] = "modified"
+
+    def _flush(self):
+        if not self._pending:
+            return
+        changes = {"added": [], "removed": [], "modified": []}
+        for path, kind in self._pending.items():
+            changes[kind].append(path)
+        self._pending = {}
+        self.callback(changes["added"], changes["removed"], changes["modified"])
+
+
+class PollingFolderWatcher(FolderWatcher):
+    """
+    Fallback watcher: rescans the folder every POLL_INTERVAL seconds and diffs it against the last scan.
+    """
+
+    def _run(self):
+        snapshot = self._scan()
+        while not self._stop.wait(POLL_INTERVAL):
+            new_snapshot = self._scan()
+            for path in new_snapshot.keys() - snapshot.keys():
+                self._record(path, "added")
+            for path in snapshot.keys() - new_snapshot.keys():
+                self._record(path, "removed")
+            for path in new_snapshot.keys() & snapshot.keys():
+                if new_snapshot[path] != snapshot[path]:
+                    self._record(path, "modified")
+            snapshot = new_snapshot
+            self._flush()
+
+
+class InotifyFolderWatcher(FolderWatcher):
+    """
+    Linux watcher using inotify (through ctypes, so there's nothing extra to install).
+
+    inotify isn't recursive, so every directory under assets gets its own watch. Changes are batched for
+    DEBOUNCE_TIME so saving a file (which is usually a few events) only calls back once.
+    """
+
+    MASK = IN_CLOSE_WRITE | IN_MODIFY | IN_CREATE | IN_DELETE | IN_MOVED_FROM | IN_MOVED_TO | IN_ONLYDIR
+    _libc = None
+
+    @classmethod
+    def available(cls):
+        if not sys.platform.startswith("linux"):
+            return False
+        if cls._libc is None:
+            try:
+                cls._libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+            except OSError:
+                return False
+        return hasattr(cls._libc, "inotify_init1")
+
+    def __init__(self, folder, callback):
+        super().__init__(folder, callback)
+        self.fd = InotifyFolderWatcher._libc.inotify_init1(os.O_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        self.watches = {}  # watch descriptor -> directory relative to folder
+        self.files = set()
+        self._add_watch("")
+        if os.path.isdir(os.path.join(self.folder, "assets")):
+            self._add_tree("assets", record=False)
+
+    def _add_watch(self, directory):
+        wd = InotifyFolderWatcher._libc.inotify_add_watch(self.fd, os.path.join(self.folder, directory).encode(),
+                                                          InotifyFolderWatcher.MASK)
+        if wd >= 0:
+            self.watches[wd] = directory
+
+    def _add_tree(self, directory, record=True):
+        """
+        Watch a directory and everything under it, adding its files to the known set.
+
+        :param directory: relative to folder
+        :param record: record the files in it as added
+        """
+        for root, _, files in os.walk(os.path.join(self.folder, directory)):
+            relative_root = os.path.relpath(root, self.folder)
+            self._add_watch(relative_root)
+            for name in files:
+                path = os.path.join(relative_root, name)
+                if path not in self.files:
+                    self.files.add(path)
+                    if record:
+                        self._record(path, "added")
+
+    def _remove_tree(self, directory):
+        prefix = directory + os.path.sep
+        for path in [x for x in self.files if x.startswith(prefix)]:
+            self.files.discard(path)
+            self._record(path, "removed")
+
+    def _handle(self, wd, mask, name):
+        if mask & IN_IGNORED:
+            self.watches.pop(wd, None)
+            return
+        directory = self.watches.get(wd)
+        if directory is None or not name:
+            return
+        if directory == "" and name != "assets":
+            return  # only the assets folder matters at the top level
+        path = os.path.join(directory, name) if directory else name
+
+        if mask & IN_ISDIR:
+            if mask & (IN_CREATE | IN_MOVED_TO):
+                self._add_tree(path)
+            elif mask & (IN_DELETE | IN_MOVED_FROM):
+                self._remove_tree(path)
+        elif directory:
+            if mask & (IN_CREATE | IN_MOVED_TO):
+                if path not in self.files:
+                    self.files.add(path)
+                    self._record(path, "added")
+                elif mask & IN_MOVED_TO:
+                    self._record(path, "modified")  # replaced by a rename, how most editors save
+            elif mask & (IN_DELETE | IN_MOVED_FROM):
+                if path in self.files:
+                    self.files.discard(path)
+                    self._record(path, "removed")
+            elif mask & (IN_CLOSE_WRITE | IN_MODIFY):
+                if path in self.files:
+                    self._record(path, "modified")
+
+    def _resync(self):
+        """
+        The kernel queue overflowed, so events were lost. Diff against a fresh scan instead.
+        """
+        current = set(self._scan())
+        for path in current - self.files:
+            self._record(path, "added")
+        for path in self.files - current:
+            self._record(path, "removed")
+        self.files = current
+        for directory in {os.path.dirname(x) for x in current} - set(self.watches.values()):
+            self._add_watch(directory)
+
+    def _run(self):
+        try:
+            while not self._stop.is_set():
+                ready, _, _ = select.select([self.fd], [], [], DEBOUNCE_TIME)
+                if not ready:
+                    self._flush()
+                    continue
+                buffer = os.read(self.fd, 64 * 1024)
+                offset = 0
+                while offset < len(buffer):
+                    wd, mask, _, length = _EVENT_HEADER.unpack_from(buffer, offset)
+                    offset += _EVENT_HEADER.size
+                    name = buffer[offset:offset + length].rstrip(b"\0").decode(errors="surrogateescape")
+                    offset += length
+                    if mask & IN_Q_OVERFLOW:
+                        self._resync()
+                    else:
+                        self._handle(wd, mask, name)
+        finally:
+            os.close(self.fd)
+
+
+def create_watcher(folder, callback, polling=False):
+    """
+    Create (but don't start) the best watcher for this platform
+
+    :param folder: folder containing assets
+    :param callback: called with (added, removed, modified) lists of relative paths, from the watcher thread
+    :param polling: force the polling watcher
+    :return: a FolderWatcher
+    """
+    if not polling and InotifyFolderWatcher.available():
+        try:
+            return InotifyFolderWatcher(folder, callback)
+        except OSError:
+            pass  # out of watches or similar, fall through
+    return PollingFolderWatcher(folder, callback)
@@ -1,13 +1,28 @@
 import abc
+import concurrent.futures
+import functools
 import os
 import pickle
+import sys
 import threading
 import time
-import pathlib
 
 from PyQt5.QtWidgets import QWidget
 
+from .cache import LRUCache
+
 REFRESH_FILES_AFTER = 1200
+FILE_INDEX_VERSION = 1
+SCAN_THREADS = 8
+MODEL_CACHE_SIZE = 4096
+TEXTURE_CACHE_BYTES = 128 * 1024 * 1024
+BLOCKSTATE_CACHE_SIZE = 1024
+
+
+def _make_location(cls, namespace, path):
+    location = object.__new__(cls)
+    location._set(namespace, path)
+    return location
 
 
 class ResourceLocation:
@@ -18,8 +33,16 @@ class ResourceLocation:
 
     minecraft:textures/block/abc.png
     extrafood:models/block/abc.json
+
+    ResourceLocations are immutable and hashable (two are equal if they point at the same file), so they can be used as
+    dict keys. They're slotted with interned strings, so lots of them (like one for every file in a workspace) stay
+    small and cheap to compare; use from_real_paths to make lots at once.
     """
 
+    __slots__ = ("namespace", "path", "_real_path", "_hash")
+
+    _namespaces = {}  # interned namespace -> "assets/namespace/"
+
     def __init__(self, *args):
         """
         Creates a new ResourceLocation
@@ -29,50 +52,99 @@ class ResourceLocation:
         >>> ResourceLocation("mc", "texture", "123.png")
         >>> # above are all the same
 
+        """
+        self._set(*self._parse(args))
+
+    @staticmethod
+    def _parse(args):
+        """
+        :return: namespace, path from constructor arguments
         """
         if len(args) == 1:
-            args = list(args)
             if ":" not in args[0]:
-                args[0] = "minecraft:" + args[0]
-            self.data = list(args[0].split(":"))
+                return "minecraft", args[0]
+            namespace, path = args[0].split(":", 1)
+            return namespace, path
         elif len(args) == 2:
-            self.data = list(args)
+            return args[0], args[1]
         else:
-            self.data = [args[0], os.path.join(*args[1:])]
+            return args[0], os.path.join(*args[1:])
+
+    def _set(self, namespace, path, real_path=None):
+        namespace = sys.intern(namespace)
+        prefix = ResourceLocation._namespaces.get(namespace)
+        if prefix is None:
+            prefix = ResourceLocation._namespaces[namespace] = os.path.join("assets", namespace, "")
+        real_path = real_path or prefix + path
+        object.__setattr__(self, "namespace", namespace)
+        object.__setattr__(self, "path", sys.intern(path))
+        object.__setattr__(self, "_real_path", real_path)
+        object.__setattr__(self, "_hash", hash(real_path))
+
+    def __setattr__(self, key, value):
+        raise AttributeError("ResourceLocations can't be changed")
+
+    def __reduce__(self):
+        return _make_location, (type(self), self.namespace, self.path)
 
     @classmethod
     def from_real_path(cls, path):
-        path = pathlib.Path(path)
-        if path.parts[0] != "assets":
-            raise ValueError(f"Path must be relative to the folder containing assets. Got {path.parts[0]} instead.")
-        domain = path.parts[1]
-        relative_path = pathlib.Path(*path.parts[2:])
-        return cls(domain, str(relative_path))
+        return cls.from_real_paths([os.path.normpath(path)])[0]
+
+    @classmethod
+    def from_real_paths(cls, paths):
+        """
+        Make ResourceLocations for lots of files at once
+
+        :param paths: normalized real paths (like the ones from Workspace.list_files), relative to the folder
+                      containing assets
+        :return: list of ResourceLocations
+        """
+        locations = []
+        new = object.__new__
+        namespaces = {}
+        for path in paths:
+            parts = path.split(os.sep, 2)
+            if parts[0] != "assets" or len(parts) < 3:
+                raise ValueError(f"Path must be relative to the folder containing assets. Got {parts[0]} instead.")
+            location = new(cls)
+            namespace = namespaces.get(parts[1])
+            if namespace is None:
+                namespace = namespaces[parts[1]] = sys.intern(parts[1])
+            location._set(namespace, parts[2], path)
+            locations.append(location)
+        return locations
+
+    @property
+    def data(self):
+        return self.namespace, self.path
 
     def __repr__(self):
-        return f'ResourceLocation({":".join(self.data)})'
+        return f'ResourceLocation({self.namespace}:{self.path})'
 
     def __str__(self):
-        return ":".join(self.data)
+        return f"{self.namespace}:{self.path}"
 
     def __getitem__(self, item):
         return self.data[item]
 
     def __add__(self, other):
         if type(other) is str:
-            return ResourceLocation(self.data[0], self.data[1] + other)
-
-    def __iadd__(self, other):
-        self.data[1] += other
+            return ResourceLocation(self.namespace, self.path + other)
+        return NotImplemented
 
     def __eq__(self, other):
+        if self is other:
+            return True
         if isinstance(other, ResourceLocation):
-            return self.get_real_path() == other.get_real_path()
-        else:
-            return super(ResourceLocation, self).__eq__(other)
+            return self._hash == other._hash and self._real_path == other._real_path
+        return NotImplemented
+
+    def __hash__(self):
+        return self._hash
 
     def get_real_path(self):
-        return os.path.join("assets", self.data[0], self.data[1])
+        return self._real_path
 
 
 class DomainResourceLocation(ResourceLocation):
@@ -81,6 +153,8 @@ class DomainResourceLocation(ResourceLocation):
     what kind of resource you want. Optionally adds filetypes
     """
 
+    __slots__ = ()
+
     def __init__(self, domain, *resourcelocation, filetype=""):
         """
         Create a new DomainResourceLocation
@@ -90,8 +164,8 @@ class DomainResourceLocation(ResourceLocation):
         :param domain: The type or domain of a resource
         :param resourcelocation: normal parameters to pass to resourcelocation constructor
         """
-        super().__init__(*resourcelocation)
-        self.data[1] = os.path.join(domain, self.data[1]) + filetype
+        namespace, path = self._parse(resourcelocation)
+        self._set(namespace, os.path.join(domain, path) + filetype)
 
 
 class FileProvider(metaclass=abc.ABCMeta):
@@ -129,6 +203,57 @@ class FileProvider(metaclass=abc.ABCMeta):
         """
         return []
 
+    def source_key(self):
+        """
+        Return a hashable value identifying this source across saves (e.g. its kind and path), used to match it
+        up with its entry in a saved file index.
+
+        :return: the key, or None if this provider's paths can't be persisted
+        """
+        return None
+
+    def fingerprint(self):
+        """
+        Return a cheap-to-compute hashable value that changes whenever the list of paths this provider has changes.
+
+        :return: the fingerprint, or None to always rescan
+        """
+        return None
+
+    def path_fingerprint(self, path):
+        """
+        Return a cheap-to-compute hashable value that changes whenever the contents of one path change. Used to
+        check if something loaded from it is still up to date.
+
+        :param path: the path
+        :return: the fingerprint, or None if the path doesn't exist (or can't be fingerprinted)
+        """
+        return None
+
+    mutable = False  # can files change while the workspace is open (without a rescan or watching noticing)?
+
+    @property
+    def watching(self):
+        """
+        :return: if changes to this source are being sent to the workspace (see watch)
+        """
+        return False
+
+    def watch(self, callback):
+        """
+        Start watching this source for changes. Optional, most sources never change while open.
+
+        :param callback: called with (added, removed, modified) lists of paths, possibly from another thread
+        :return: True if this provider supports watching
+        """
+        return False
+
+    def unwatch(self):
+        """
+        Stop watching this source for changes
+        """
+        pass
+
     @classmethod
     def create_edit_widget(self, parent) -> QWidget:
         """
@@ -160,27 +285,183 @@ class Workspace:
         self.name = name
         self.mode = mode
         self.file_list_cache = []
+        self.path_index = {}  # normalized path -> provider that wins it
+        self.missing_paths = set()  # normalized paths no provider had when asked, until they're rerouted
+        self.provider_paths = {}  # provider -> normalized paths it had when last scanned
+        self.provider_fingerprints = {}  # provider -> fingerprint when last scanned
         self.last_file_update_time = 0
+        self.save_path = None
+        self.scan_threads = SCAN_THREADS  # how many providers to scan at once when refreshing
+        self.watch_files = False  # opt-in: watch sources for changes instead of waiting for a rescan
 
         self.file_list_lock = threading.Lock()
+        self.change_listeners = []
+        self.model_cache = LRUCache(MODEL_CACHE_SIZE)  # see BlockModel.load_from_file
+        self.texture_cache = LRUCache(TEXTURE_CACHE_BYTES, sizeof=lambda x: len(x.data))  # see Texture.load_from_file
+        self.blockstate_cache = LRUCache(BLOCKSTATE_CACHE_SIZE)  # see BlockState.load_from_file
 
     @classmethod
     def load_from_file(cls, path):
+        """
+        Load a workspace, along with its saved file index if there is one.
+
+        Sources whose fingerprint has changed are rescanned the next time the file cache is refreshed with
+        changed_only set (see :py:meth:`Workspace.refresh_file_cache`)
+
+        :param path: path to the .mcjtwp file
+        :return: the workspace
+        """
         with open(path, "rb") as f:
-            return pickle.load(f)
+            workspace = pickle.load(f)
+        workspace.save_path = path
+        workspace._load_file_index()
+        return workspace
 
     def __getstate__(self):
         dict_ = self.__dict__.copy()
         del dict_["file_list_lock"]
+        del dict_["change_listeners"]
+        del dict_["model_cache"]
+        del dict_["texture_cache"]
+        del dict_["blockstate_cache"]
+        # the file index is saved separately, see save_file_index
+        for i in ("file_list_cache", "path_index", "missing_paths", "provider_paths", "provider_fingerprints",
+                  "save_path"):
+            del dict_[i]
+        dict_["last_file_update_time"] = 0
         return dict_
 
     def __setstate__(self, state):
         self.__dict__.update(state)
         self.file_list_lock = threading.Lock()
+        self.file_list_cache = []
+        self.path_index = {}
+        self.missing_paths = set()
+        self.provider_paths = {}
+        self.provider_fingerprints = {}
+        self.last_file_update_time = 0
+        self.save_path = None
+        self.__dict__.setdefault("scan_threads", SCAN_THREADS)
+        self.__dict__.setdefault("watch_files", False)
+        self.change_listeners = []
+        self.model_cache = LRUCache(MODEL_CACHE_SIZE)
+        self.texture_cache = LRUCache(TEXTURE_CACHE_BYTES, sizeof=lambda x: len(x.data))
+        self.blockstate_cache = LRUCache(BLOCKSTATE_CACHE_SIZE)
 
     def save_to_file(self, path):
         with open(path, "wb") as f:
             pickle.dump(self, f, protocol=pickle.HIGHEST_PROTOCOL)
+        self.save_path = path
+        self.save_file_index()
+
+    @property
+    def file_index_path(self):
+        if self.save_path is None:
+            return None
+        return str(self.save_path) + ".index"
+
+    def save_file_index(self):
+        """
+        Save the file index (paths and fingerprint of each source) next to the workspace file.
+
+        Does nothing if this workspace has never been saved.
+        """
+        if self.file_index_path is None:
+            return
+        with self.file_list_lock:
+            sources = {}
+            for i in self.providers:
+                key = i.source_key()
+                if key is None or i not in self.provider_paths:
+                    continue
+                sources[key] = (self.provider_fingerprints.get(i), self.provider_paths[i])
+        tmp_path = self.file_index_path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            pickle.dump({"version": FILE_INDEX_VERSION, "sources": sources}, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, self.file_index_path)
+
+    def _load_file_index(self):
+        """
+        Seed the file cache from the saved file index. Missing or unreadable indexes are ignored.
+        """
+        try:
+            with open(self.file_index_path, "rb") as f:
+                data = pickle.load(f)
+        except (OSError, pickle.UnpicklingError, EOFError):
+            return
+        if data.get("version") != FILE_INDEX_VERSION:
+            return
+
+        with self.file_list_lock:
+            for i in self.providers:
+                key = i.source_key()
+                if key in data["sources"]:
+                    self.provider_fingerprints[i], self.provider_paths[i] = data["sources"][key]
+            self._rebuild_path_index()
+            self._rebuild_file_list()
+            if all(x in self.provider_paths for x in self.providers):
+                self.last_file_update_time = time.time()
+
+    @staticmethod
+    def _normalize_path(path):
+        if hasattr(path, "get_real_path") and callable(path.get_real_path):
+            path = path.get_real_path()
+
+        return os.path.normpath(path)
+
+    def _find_provider(self, path):
+        """
+        Find the provider that serves a (normalized) path.
+
+        Uses the routing table (and the paths remembered as missing) when the route can be trusted, which is when
+        no provider up to the one that wins it can change without telling the workspace (see _route_is_current).
+        Otherwise, e.g. with an unwatched folder in front, every provider is asked, so files created, deleted or
+        overridden since the last scan are still found.
+
+        :param path: normalized path
+        :return: the provider, or None
+        """
+        provider = self.path_index.get(path)
+        if provider is not None and self._route_is_current(provider):
+            return provider
+        if provider is None and path in self.missing_paths and self._route_is_current(None):
+            return None
+        with self.file_list_lock:
+            for i in self.providers:
+                if i.provides_path(path):
+                    if self._route_is_current(i):
+                        self.path_index[path] = i
+                    return i
+            if self._route_is_current(None):
+                self.missing_paths.add(path)
+        return None
+
+    def _route_is_current(self, provider):
+        """
+        Can a cached route to provider (or None for missing) be trusted? Only if every provider up to it either never
+        changes or is being watched, since otherwise files can appear in or vanish from them unnoticed.
+        """
+        for i in self.providers:
+            if i.mutable and not i.watching:
+                return False
+            if i is provider:
+                return True
+        return provider is None
+
+    def file_fingerprint(self, path):
+        """
+        Get a fingerprint for the contents of a file, which changes if the file is edited or another source starts
+        providing it. Things loaded from the workspace use this to check that cached copies are still good.
+
+        :param path: path to file, can be either a string (real path) or ResourceLocation (mod and path)
+        :return: a hashable fingerprint, or None if the file doesn't exist
+        """
+        path = self._normalize_path(path)
+
+        provider = self._find_provider(path)
+        if provider is None:
+            return None
+        return provider.source_key(), provider.path_fingerprint(path)
 
     def get_file(self, path, mode="r"):
         """
@@ -190,15 +471,12 @@ class Workspace:
         :param path: path to file, can be either a string (real path) or ResourceLocation (mod and path)
         :return: an open file referring to it
         """
-        if hasattr(path, "get_real_path") and callable(path.get_real_path):
-            path = path.get_real_path()
+        path = self._normalize_path(path)
 
-        path = os.path.normpath(path)
-
-        for i in self.providers:
-            if i.provides_path(path):
-                return i.open_path(path, mode)
-        raise FileNotFoundError(f"Could not find a reference to file {path}")
+        provider = self._find_provider(path)
+        if provider is None:
+            raise FileNotFoundError(f"Could not find a reference to file {path}")
+        return provider.open_path(path, mode)
 
     def has_file(self, path):
         """
@@ -207,12 +485,7 @@ class Workspace:
         :param path: path to file, can be either a string (real path) or ResourceLocation (mod and path)
         :return: does the path exist
         """
-        if hasattr(path, "get_real_path") and callable(path.get_real_path):
-            path = path.get_real_path()
-
-        path = os.path.normpath(path)
-
-        return any((x.provides_path(path) for x in self.providers))
+        return self._find_provider(self._normalize_path(path)) is not None
 
     def list_files(self):
         """
@@ -225,27 +498,205 @@ class Workspace:
         :return: A list of all paths
         """
         if time.time() - self.last_file_update_time > REFRESH_FILES_AFTER:
-            self.refresh_file_cache(wait_for_complete=not self.file_list_cache)
+            self.refresh_file_cache(wait_for_complete=not self.file_list_cache, changed_only=True)
         with self.file_list_lock:
             return self.file_list_cache
 
-    def _refresh_file_cache(self):
+    def add_change_listener(self, listener):
         """
-        Refresh the list of known paths to this workspace. Can take a while!
+        Register a function to be told about changes to the files in this workspace (only sent while watching, see
+        :py:meth:`Workspace.start_watching`).
+
+        The listener is called with (added, removed, modified), each a list of normalized paths, from a watcher
+        thread. Paths in added and removed were not/are no longer in the workspace, paths in modified changed
+        contents or now come from a different source.
+
+        :param listener: callable
         """
+        self.change_listeners.append(listener)
 
-        file_list_cache = []
+    def remove_change_listener(self, listener):
+        if listener in self.change_listeners:
+            self.change_listeners.remove(listener)
+
+    def start_watching(self):
+        """
+        Start watching every provider that supports it, applying changes to the file index as they happen.
+        """
+        for i in self.providers:
+            i.watch(functools.partial(self._on_provider_change, i))
+
+    def stop_watching(self):
         for i in self.providers:
-            file_list_cache.extend(i.list_paths())
+            i.unwatch()
+
+    def _on_provider_change(self, provider, added, removed, modified):
+        """
+        Apply changes reported by a provider's watcher to the file index, then tell the listeners.
+        """
+        added = [os.path.normpath(x) for x in added]
+        removed = [os.path.normpath(x) for x in removed]
+        modified = [os.path.normpath(x) for x in modified]
+
         with self.file_list_lock:
-            self.file_list_cache = file_list_cache
+            if provider not in self.providers:
+                return
+            removed_set = set(removed)
+            paths = self.provider_paths.get(provider, [])
+            if removed_set:
+                paths = [x for x in paths if x not in removed_set]
+            self.provider_paths[provider] = paths + added
+            self.provider_fingerprints.pop(provider, None)  # the saved fingerprint is out of date now
+
+            affected = added + removed
+            previous = {x: self.path_index.get(x) for x in affected}
+            self._reroute(affected)
+            self._rebuild_file_list()
+
+            ws_added = [x for x in added if previous[x] is None and x in self.path_index]
+            ws_removed = [x for x in removed if previous[x] is not None and x not in self.path_index]
+            ws_modified = [x for x in modified if self.path_index.get(x) is provider]
+            ws_modified.extend(x for x in affected if previous[x] is not None and
+                               self.path_index.get(x, previous[x]) is not previous[x])
+
+        for i in ws_removed + ws_modified:
+            self.model_cache.discard(i)
+            self.texture_cache.discard((i, True))
+            self.texture_cache.discard((i, False))
+            self.blockstate_cache.discard(i)
+        for listener in list(self.change_listeners):
+            listener(ws_added, ws_removed, ws_modified)
+
+    def add_provider(self, provider, priority=None):
+        """
+        Add a provider to this workspace, updating the routing table for just its paths.
+
+        :param provider: the provider to add
+        :param priority: position in the provider list (lower wins), defaults to the end
+        """
+        fingerprint = provider.fingerprint()
+        paths = [os.path.normpath(x) for x in provider.list_paths()]
+        with self.file_list_lock:
+            if priority is None:
+                self.providers.append(provider)
+            else:
+                self.providers.insert(priority, provider)
+            self.provider_paths[provider] = paths
+            self.provider_fingerprints[provider] = fingerprint
+            self._reroute(paths)
+            self._rebuild_file_list()
+        self.save_file_index()
+
+    def remove_provider(self, provider):
+        """
+        Remove a provider from this workspace, rerouting any paths it was serving.
+
+        :param provider: the provider to remove
+        """
+        provider.unwatch()
+        with self.file_list_lock:
+            self.providers.remove(provider)
+            paths = self.provider_paths.pop(provider, [])
+            self.provider_fingerprints.pop(provider, None)
+            self._reroute([x for x in paths if self.path_index.get(x) is provider])
+            self._rebuild_file_list()
+        self.save_file_index()
+
+    def move_provider(self, provider, priority):
+        """
+        Change the priority of a provider, rerouting only the paths it has.
+
+        :param provider: the provider to move
+        :param priority: new position in the provider list (lower wins)
+        """
+        with self.file_list_lock:
+            self.providers.remove(provider)
+            self.providers.insert(priority, provider)
+            self._reroute(self.provider_paths.get(provider, []))
+            self._rebuild_file_list()
+        self.save_file_index()
+
+    def _reroute(self, paths):
+        """
+        Recompute the winning provider for some paths, in priority order.
+
+        :param paths: normalized paths to recompute
+        """
+        self.missing_paths.difference_update(paths)
+        for path in paths:
+            for i in self.providers:
+                if i.provides_path(path):
+                    self.path_index[path] = i
+                    break
+            else:
+                self.path_index.pop(path, None)
+
+    def _rebuild_path_index(self):
+        path_index = {}
+        for i in reversed(self.providers):  # higher priority providers overwrite lower ones
+            path_index.update(dict.fromkeys(self.provider_paths.get(i, []), i))
+        self.path_index = path_index
+        self.missing_paths = set()
+
+    def _rebuild_file_list(self):
+        file_list_cache = []
+        for i in self.providers:
+            file_list_cache.extend(self.provider_paths.get(i, []))
+        self.file_list_cache = file_list_cache
+
+    def _scan_provider(self, provider, changed_only):
+        """
+        Scan one provider. Run on the refresh thread pool.
+
+        :return: fingerprint, list of normalized paths
+        """
+        fingerprint = provider.fingerprint()
+        if changed_only and fingerprint is not None and provider in self.provider_paths and \
+                self.provider_fingerprints.get(provider) == fingerprint:
+            return fingerprint, self.provider_paths[provider]
+        return fingerprint, [os.path.normpath(x) for x in provider.list_paths()]
 
-    def refresh_file_cache(self, wait_for_complete=True):
+    def _refresh_file_cache(self, changed_only=False, progress=None, threads=None):
+        """
+        Refresh the list of known paths to this workspace. Can take a while!
+
+        Providers are scanned in parallel (reading jar directories and walking folders is mostly waiting on disk),
+        then merged in priority order.
+
+        :param changed_only: only rescan sources whose fingerprint changed since they were last scanned
+        :param progress: optional callable, called with (providers done, total providers) as each one finishes
+        :param threads: how many providers to scan at once, defaults to scan_threads
+        """
+
+        providers = list(self.providers)
+        provider_paths = {}
+        provider_fingerprints = {}
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max(1, threads or self.scan_threads)) as pool:
+            futures = {pool.submit(self._scan_provider, i, changed_only): i for i in providers}
+            for n, future in enumerate(concurrent.futures.as_completed(futures), 1):
+                provider = futures[future]
+                provider_fingerprints[provider], provider_paths[provider] = future.result()
+                if progress is not None:
+                    progress(n, len(providers))
+
+        with self.file_list_lock:
+            self.provider_paths = provider_paths
+            self.provider_fingerprints = provider_fingerprints
+            self._rebuild_path_index()
+            self._rebuild_file_list()
+            self.last_file_update_time = time.time()
+        self.save_file_index()
+
+    def refresh_file_cache(self, wait_for_complete=True, changed_only=False, progress=None, threads=None):
         """
         Refresh the list of known paths to this workspace. Allows you to do it in the background if you want.
         :param wait_for_complete: Wait for completion of the task
+        :param changed_only: only rescan sources whose fingerprint changed since they were last scanned
+        :param progress: optional callable, called with (providers done, total providers). Called from a worker
+                         thread if not waiting for completion
+        :param threads: how many providers to scan at once, defaults to scan_threads
         """
         if wait_for_complete:
-            self._refresh_file_cache()
+            self._refresh_file_cache(changed_only, progress, threads)
         else:
-            threading.Thread(target=self._refresh_file_cache).start()
+            threading.Thread(target=self._refresh_file_cache, args=(changed_only, progress, threads)).start()
@@ -1,4 +1,5 @@
-import pathlib
+import bisect
+import os
 
 from PyQt5.QtCore import QAbstractItemModel, Qt, QVariant, QModelIndex, pyqtSlot, QSortFilterProxyModel, pyqtSignal
 from PyQt5.QtWidgets import QWidget, QTabWidget, QTreeView, QVBoxLayout, QSizePolicy
@@ -8,11 +9,27 @@ from ...plugin.baseplugin import BasePlugin
 
 
 class FileModel(QAbstractItemModel):
+    """
+    Tree of every file in the workspace, by namespace then folder.
+
+    Big workspaces have hundreds of thousands of files, so the tree isn't built up front: the paths are kept in one
+    sorted list, where everything inside a folder is a contiguous range (found with bisect), and a folder's children
+    are only made when the view expands it (see fetchMore). Nodes remember their row and parent, so the lookups Qt
+    does constantly while painting are O(1).
+    """
+
     class FileModelNode:
-        def __init__(self, parent, resourcelocation, text):
+        __slots__ = ("parent", "row", "text", "path")
+
+        def __init__(self, parent, row, text, path):
             self.parent = parent
-            self.resourcelocation = resourcelocation
+            self.row = row
             self.text = text
+            self.path = path  # real path, for folders it ends in a separator
+
+        @property
+        def resourcelocation(self):
+            return ResourceLocation.from_real_path(self.path)
 
         def __len__(self):
             return 0
@@ -20,60 +37,171 @@ class FileModel(QAbstractItemModel):
         def childAtRow(self, row):
             raise IndexError("Bad")
 
-        def row(self):
-            if self.parent:
-                return self.parent.children.index(self)
-            return 0
-
     class FolderOrDomainModelNode(FileModelNode):
-        def __init__(self, parent, name):
-            super(FileModel.FolderOrDomainModelNode, self).__init__(parent, name, name)
-            self.children = []
+        __slots__ = ("children", "by_name")
+
+        def __init__(self, parent, row, text, path):
+            super(FileModel.FolderOrDomainModelNode, self).__init__(parent, row, text, path)
+            self.children = None  # not loaded yet
+            self.by_name = {}
+
+        @property
+        def resourcelocation(self):
+            return self.text
 
         def __len__(self):
-            return len(self.children)
+            return len(self.children) if self.children is not None else 0
 
         def childAtRow(self, row):
             return self.children[row]
 
+    filesChanged = pyqtSignal(list, list)
+
+    ROOT = os.path.join("assets", "")
+
     def __init__(self, workspace):
         super().__init__()
         self.workspace = workspace
-        self.workspace.refresh_file_cache()  # make sure files are up to date
-        self.root = FileModel.FolderOrDomainModelNode(None, "root node")
-
-        resources = map(ResourceLocation.from_real_path, workspace.list_files())
-        hives = {}
-        for i in resources:
-            if i.data[0] not in hives:
-                hives[i.data[0]] = []
-            hives[i.data[0]].append(i)
-
-        for entry in hives:
-            root = FileModel.FolderOrDomainModelNode(self.root, entry)
-            self.root.children.append(root)
-            nodes = {"": root}
-
-            for resource in hives[entry]:
-                split_up = pathlib.Path(resource.data[1]).parts
-                basename = ""
-                parent_ = ""
-                for i in split_up[:-1]:
-                    parent_ = basename
-                    if basename != "":
-                        basename += "/"
-                    basename += i
-                    if basename not in nodes:
-                        new_node = FileModel.FolderOrDomainModelNode(nodes[parent_], i)
-                        nodes[parent_].children.append(new_node)
-                        nodes[basename] = new_node
-                node = nodes[basename]
-                node.children.append(FileModel.FileModelNode(node, resource, split_up[-1]))
+        self.workspace.refresh_file_cache(changed_only=True)  # make sure files are up to date
+        self.root = FileModel.FolderOrDomainModelNode(None, 0, "root node", FileModel.ROOT)
+        self.paths = sorted(x for x in set(workspace.list_files()) if self._in_tree(x))
+        self._set_children(self.root, self._load_children(self.root))
+
+        self.filesChanged.connect(self.apply_file_changes)
+        self.workspace.add_change_listener(self._on_workspace_change)
+
+    def detach(self):
+        """
+        Stop listening for changes to the workspace
+        """
+        self.workspace.remove_change_listener(self._on_workspace_change)
+
+    def _on_workspace_change(self, added, removed, modified):
+        self.filesChanged.emit(added, removed)  # called from a watcher thread, this gets us onto the ui one
+
+    @staticmethod
+    def _in_tree(path):
+        return path.startswith(FileModel.ROOT) and os.sep in path[len(FileModel.ROOT):]  # assets/namespace/...
+
+    def _range(self, prefix, lo=0, hi=None):
+        """
+        :return: start, end of the paths starting with prefix (which ends in a separator)
+        """
+        hi = len(self.paths) if hi is None else hi
+        start = bisect.bisect_left(self.paths, prefix, lo, hi)
+        # everything starting with "prefix/" sorts before "prefix" + the character after the separator
+        return start, bisect.bisect_left(self.paths, prefix[:-1] + chr(ord(os.sep) + 1), start, hi)
+
+    def _index_for(self, node):
+        if node is self.root:
+            return QModelIndex()
+        return self.createIndex(node.row, 0, node)
+
+    @staticmethod
+    def _make_node(parent, row, name, is_folder):
+        if is_folder:
+            return FileModel.FolderOrDomainModelNode(parent, row, name, parent.path + name + os.sep)
+        return FileModel.FileModelNode(parent, row, name, parent.path + name)
+
+    def _load_children(self, folder):
+        """
+        Make the nodes for a folder's children from its range of paths, skipping over each subfolder with bisect
+
+        :return: list of nodes, in row order
+        """
+        children = []
+        prefix = folder.path
+        i, end = self._range(prefix)
+        while i < end:
+            name, sep, rest = self.paths[i][len(prefix):].partition(os.sep)
+            if sep:
+                i = self._range(prefix + name + os.sep, i, end)[1]
+            else:
+                i += 1
+            children.append(self._make_node(folder, len(children), name, bool(sep)))
+        return children
+
+    def _set_children(self, folder, children):
+        folder.children = children
+        folder.by_name = {x.text: x for x in children}
+
+    def _loaded_chain(self, path):
+        """
+        :return: the nodes on the way to path that exist, from the root
+        """
+        chain = [self.root]
+        parts = path[len(FileModel.ROOT):].split(os.sep)
+        for name in parts:
+            node = chain[-1]
+            if type(node) is not FileModel.FolderOrDomainModelNode or node.children is None:
+                break
+            child = node.by_name.get(name)
+            if child is None:
+                break
+            chain.append(child)
+        return chain, parts
+
+    def _add_file(self, path):
+        i = bisect.bisect_left(self.paths, path)
+        if i < len(self.paths) and self.paths[i] == path:
+            return
+        self.paths.insert(i, path)
+        chain, parts = self._loaded_chain(path)
+        parent = chain[-1]
+        if len(chain) > len(parts) or parent.children is None:
+            return  # already there, or inside a folder that'll see it when it's loaded
+        name = parts[len(chain) - 1]
+        node = self._make_node(parent, 0, name, len(chain) < len(parts))
+        # same order as _load_children: by path, so folders (ending in a separator) go where their files would
+        row = node.row = bisect.bisect_left([x.path for x in parent.children], node.path)
+        self.beginInsertRows(self._index_for(parent), row, row)
+        parent.children.insert(row, node)
+        parent.by_name[name] = node
+        for sibling in parent.children[row + 1:]:
+            sibling.row += 1
+        self.endInsertRows()
+
+    def _remove_file(self, path):
+        i = bisect.bisect_left(self.paths, path)
+        if i == len(self.paths) or self.paths[i] != path:
+            return
+        del self.paths[i]
+        chain, parts = self._loaded_chain(path)
+        for node in chain[1:]:
+            # remove the file, or the outermost folder it leaves empty
+            start, end = self._range(node.path) if node.path != path else (0, 0)
+            if start == end:
+                self._remove_node(node)
+                break
+
+    def _remove_node(self, node):
+        parent = node.parent
+        row = node.row
+        self.beginRemoveRows(self._index_for(parent), row, row)
+        del parent.children[row]
+        del parent.by_name[node.text]
+        for sibling in parent.children[row:]:
+            sibling.row -= 1
+        self.endRemoveRows()
+
+    @pyqtSlot(list, list)
+    def apply_file_changes(self, added, removed):
+        """
+        Apply changes to the workspace's files as row inserts/removals, instead of rebuilding the whole model
+
+        :param added: paths that were added
+        :param removed: paths that were removed
+        """
+        for path in removed:
+            self._remove_file(path)
+        for path in added:
+            if self._in_tree(path):
+                self._add_file(path)
 
     def flags(self, index):
         n = self.nodeFromIndex(index)
-        if n is None:
-            return 0
+        if n is None or n is self.root:
+            return Qt.NoItemFlags
         if type(n) is FileModel.FileModelNode:
             return Qt.ItemIsSelectable | Qt.ItemIsEnabled
         else:
@@ -103,15 +231,29 @@ class FileModel(QAbstractItemModel):
     def rowCount(self, parent=None, *args, **kwargs):
         return len(self.nodeFromIndex(parent))
 
+    def hasChildren(self, parent=None, *args, **kwargs):
+        return type(self.nodeFromIndex(parent)) is FileModel.FolderOrDomainModelNode  # empty folders are removed
+
+    def canFetchMore(self, parent):
+        node = self.nodeFromIndex(parent)
+        return type(node) is FileModel.FolderOrDomainModelNode and node.children is None
+
+    def fetchMore(self, parent):
+        if not self.canFetchMore(parent):
+            return
+        node = self.nodeFromIndex(parent)
+        children = self._load_children(node)
+        if not children:
+            self._set_children(node, children)
+            return
+        self.beginInsertRows(parent, 0, len(children) - 1)
+        self._set_children(node, children)
+        self.endInsertRows()
+
     def parent(self, index=None):
         if not index.isValid():
             return QModelIndex()
-        child = index.internalPointer()
-        parent = child.parent
-
-        if parent == self.root:
-            return QModelIndex()
-        return self.createIndex(parent.row(), 0, parent)
+        return self._index_for(index.internalPointer().parent)
 
     def nodeFromIndex(self, index):
         if index.isValid():
@@ -120,7 +262,9 @@ class FileModel(QAbstractItemModel):
             return self.root
 
     def index(self, p_int, p_int_1, parent=None, *args, **kwargs):
-        assert self.root
+        assert self.root is not None
+        if not self.hasIndex(p_int, p_int_1, parent):
+            return QModelIndex()
         branch = self.nodeFromIndex(parent)
         assert branch is not None
         return self.createIndex(p_int, p_int_1, branch.childAtRow(p_int))
@@ -144,6 +288,9 @@ class NavigatorWidget(QWidget):
 
     @pyqtSlot(Workspace)
     def setWorkspace(self, w):
+        for i in getattr(self, "models", []):
+            if hasattr(i, "detach"):
+                i.detach()
         self.workspace = w
         if w is None:
             self.models = []
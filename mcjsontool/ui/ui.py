@@ -20,6 +20,10 @@ class JSONToolUI(QMainWindow, main_ui.Ui_MainWindow):
         self.workspaceWizard = None
 
         self.actionWorkspace.triggered.connect(self.newWorkspace)
+        self.actionWatchFiles = QAction("Watch for file changes", self)
+        self.actionWatchFiles.setCheckable(True)
+        self.actionWatchFiles.toggled.connect(self.setWatchFiles)
+        self.menuTools.addAction(self.actionWatchFiles)
         self.activePlugins = []
         self.recent_workspaces = RecentStore("workspaces")
 
@@ -56,12 +60,29 @@ class JSONToolUI(QMainWindow, main_ui.Ui_MainWindow):
         self.setWorkspace(workspace)
         self.update_recent()
 
+    @pyqtSlot(bool)
+    def setWatchFiles(self, watch):
+        if self.workspace is None or self.workspace.watch_files == watch:
+            return
+        self.workspace.watch_files = watch
+        if watch:
+            self.workspace.start_watching()
+        else:
+            self.workspace.stop_watching()
+        if self.workspace.save_path is not None:
+            self.workspace.save_to_file(self.workspace.save_path)
+
     @pyqtSlot(Workspace)
     def setWorkspace(self, w):
+        if getattr(self, "workspace", None) is not None:
+            self.workspace.stop_watching()
         self.navWidget.setWorkspace(w)
         self.open_file_man.setWorkspace(w)
         QMetaObject.invokeMethod(self.asyncModelRenderer, "setWorkspace", Q_ARG(Workspace, w))
         self.workspace = w
+        if w is not None and w.watch_files:
+            w.start_watching()
+        self.actionWatchFiles.setChecked(w is not None and w.watch_files)
 
     @pyqtSlot(Workspace, str)
     def setNewWorkspace(self, w: Workspace, s):
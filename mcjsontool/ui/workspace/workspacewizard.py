@@ -78,8 +78,8 @@ class WorkspaceWizard(QWizard, Ui_Wizard):
             workspace = Workspace(self.nameEdit.text(), Workspace.EDITMODE_EDIT if self.editMode.isChecked() else Workspace.EDITMODE_RESOURCEPACK)
             for i in self.edit_widgets:
                 workspace.providers.append(i.create_provider())
-            workspace.refresh_file_cache(wait_for_complete=False)
             workspace.save_to_file(self.locationEdit.text())
+            workspace.refresh_file_cache(wait_for_complete=False)  # saves the file index once done
             self.newWorkspaceEmitted.emit(workspace, self.locationEdit.text())
 
     def validateCurrentPage(self):
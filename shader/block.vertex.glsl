@@ -2,13 +2,17 @@
 
 layout(location = 0) in vec4 Pos;
 layout(location = 1) in vec2 UV;
+layout(location = 2) in vec3 Animation; // frames, ticks per frame, distance between frames
 
 layout (location = 0) uniform mat4 ModelTransform;
 layout (location = 1) uniform mat4 ProjectionView;
+layout (location = 2) uniform vec2 UVScale;
+layout (location = 3) uniform float Time; // in ticks
 
 out vec2 FragUV;
 
 void main() {
     gl_Position = ProjectionView * ModelTransform * Pos;
-    FragUV = UV;
+    float frame = mod(floor(Time / Animation.y), Animation.x);
+    FragUV = (UV + vec2(0, frame * Animation.z)) * UVScale;
 }
\ No newline at end of file
@@ -0,0 +1,19 @@
+#version 430 core
+
+layout(location = 0) in vec4 Pos;
+layout(location = 1) in vec2 UV;
+layout(location = 2) in vec3 Animation; // frames, ticks per frame, distance between frames
+layout(location = 3) in mat4 InstanceTransform; // per instance, takes locations 3-6
+layout(location = 7) in vec2 InstanceUVOffset; // per instance, where the instance's textures are in the atlas
+
+layout (location = 1) uniform mat4 ProjectionView;
+layout (location = 2) uniform vec2 UVScale;
+layout (location = 3) uniform float Time; // in ticks
+
+out vec2 FragUV;
+
+void main() {
+    gl_Position = ProjectionView * InstanceTransform * Pos;
+    float frame = mod(floor(Time / Animation.y), Animation.x);
+    FragUV = (UV + InstanceUVOffset + vec2(0, frame * Animation.z)) * UVScale;
+}
\ No newline at end of file
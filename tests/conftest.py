@@ -0,0 +1 @@
+collect_ignore = ["load_blockmodel_test.py"]  # interactive script, needs a window and a minecraft jar
@@ -0,0 +1,84 @@
+import json
+import os
+
+import glm
+import numpy as np
+from PIL import Image
+
+from mcjsontool.render.headless import render_sheet_software
+from mcjsontool.render.model import BlockModel
+from mcjsontool.render.softrender import SoftwareRenderer
+from mcjsontool.resource.fileloaders import FolderFileProvider
+from mcjsontool.resource.workspace import Workspace
+
+RED = (255, 0, 0, 255)
+GREEN = (0, 255, 0, 255)
+SIZE = 64
+
+
+def _make_workspace(folder):
+    """
+    A folder pack with one full cube: the top is green with a transparent corner, everything else is red
+    """
+    textures = os.path.join(folder, "assets", "test", "textures", "block")
+    models = os.path.join(folder, "assets", "test", "models", "block")
+    os.makedirs(textures)
+    os.makedirs(models)
+    top = np.zeros((16, 16, 4), dtype=np.uint8)
+    top[...] = GREEN
+    top[:8, :8] = 0
+    Image.fromarray(top).save(os.path.join(textures, "top.png"))
+    Image.fromarray(np.full((16, 16, 4), RED, dtype=np.uint8)).save(os.path.join(textures, "side.png"))
+    faces = {x: {"texture": "#side"} for x in ("down", "north", "south", "east", "west")}
+    faces["up"] = {"texture": "#top"}
+    with open(os.path.join(models, "cube.json"), "w") as f:
+        json.dump({"textures": {"top": "test:block/top", "side": "test:block/side"},
+                   "elements": [{"from": [0, 0, 0], "to": [16, 16, 16], "faces": faces}]}, f)
+    block = os.path.join(folder, "assets", "minecraft", "models", "block")
+    os.makedirs(block)
+    with open(os.path.join(block, "block.json"), "w") as f:
+        f.write("{}")  # what models without a parent inherit from
+
+    workspace = Workspace("test", Workspace.EDITMODE_EDIT)
+    workspace.providers.append(FolderFileProvider(folder))
+    workspace.refresh_file_cache()
+    return workspace
+
+
+def test_cube_from_above(tmp_path):
+    workspace = _make_workspace(str(tmp_path))
+    model = BlockModel.load_from_file(workspace, "assets/test/models/block/cube.json")
+
+    # straight down at the top of the cube, which covers the middle quarter of the image
+    view = glm.lookAt(glm.vec3(8, 50, 8), glm.vec3(8, 8, 8), glm.vec3(0, 0, -1))
+    proj = glm.ortho(-16, 16, -16, 16, 0.1, 100)
+    for shared_atlas in (True, False):
+        image = SoftwareRenderer(workspace, shared_atlas).render(model, view, None, proj, SIZE)
+
+        covered = image[..., 3] > 0
+        assert covered.sum() == (SIZE // 2) ** 2
+        assert covered[SIZE // 4:3 * SIZE // 4, SIZE // 4:3 * SIZE // 4].all()
+
+        colors = {tuple(x) for x in image[covered]}
+        assert colors == {RED, GREEN}  # nearest sampling, nothing blended
+        # the transparent corner of the top is discarded, showing the bottom through it
+        assert (image[covered] == RED).all(axis=1).sum() == (SIZE // 4) ** 2
+
+
+def test_corrupt_texture_fails(tmp_path):
+    workspace = _make_workspace(str(tmp_path))
+    with open(os.path.join(str(tmp_path), "assets", "minecraft", "models", "block", "block.json"), "w") as f:
+        json.dump({"display": {"gui": {"rotation": [30, 225, 0], "translation": [0, 0, 0],
+                                       "scale": [0.625, 0.625, 0.625]}}}, f)  # so render_icon has a gui transform
+    folder = os.path.join(str(tmp_path), "assets", "test")
+    with open(os.path.join(folder, "textures", "block", "broken.png"), "wb") as f:
+        f.write(b"\x89PNG\r\n\x1a\n")  # just the signature, PIL can't identify it
+    with open(os.path.join(folder, "models", "block", "broken.json"), "w") as f:
+        json.dump({"textures": {"all": "test:block/broken"},
+                   "elements": [{"from": [0, 0, 0], "to": [16, 16, 16], "faces": {"up": {"texture": "#all"}}}]}, f)
+    workspace.refresh_file_cache()
+
+    models = [("test:block/" + x, "assets/test/models/block/{}.json".format(x)) for x in ("broken", "cube")]
+    sheet, index, failed = render_sheet_software(workspace, models, SIZE)
+    assert failed == ["test:block/broken"]
+    assert list(index) == ["test:block/cube"]